@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+'''
+Benchmarks for pygoo's performance work, to be run again after changing
+the code they time:
+
+    python benchmarks.py [name...]
+
+runs the named benchmarks, or all of them.  Each prints its own results.
+
+    scanner - tokens per second, with Scanner.tokenize() and with the
+        match-and-scan-the-groups loop it replaced, and the cost of
+        making a Scanner, with and without the compiled pattern shared.
+    memory - the memory parsing a big spec takes, and what's left for the
+        cyclic garbage collector to free once it's dropped.
+    windows - making the same window over and over, parsing its spec
+        each time with toXML() and realize(), and with the Plan kept in
+        PLANS.  With Tk if there's a display, a RecordingBackend if not.
+'''
+import gc
+import re
+import sys
+import time
+import Tkinter
+from pygoo import (
+    Scanner, iterXML, toXML, realize, PLANS, TK, RecordingBackend)
+
+try:
+    import resource
+except ImportError:
+    resource = None # Not on Windows.
+
+
+def best(function, repeat=5):
+    '''
+    Return the shortest of repeat timings of function(), in seconds.
+    '''
+    times = []
+    for i in range(repeat):
+        t = time.time()
+        function()
+        times.append(time.time() - t)
+    return min(times)
+
+
+# A spec to tokenize, many times over.
+SPEC = '''
+    mickey = minnie
+    frame
+        text
+            width = 20
+            height = 10
+            <Enter> = RedCallback
+            sticky = nsew
+            row = 1
+            rowspan = 2
+        .
+        button
+            text = "A Simple Demo Widget"
+            <Button-1> = GreenCallback
+            sticky = nsew
+            column = 1
+        .
+    .
+    '''
+
+
+def groupsTokenize(scanner, input_):
+    # How Scanner.tokenize() used to work: match at each position and
+    # look through all the groups for the one that matched.
+    pos = 0
+    n = len(input_)
+    while pos < n:
+        m = scanner.re.match(input_, pos)
+        if m is None:
+            scanner.error(input_, pos)
+        for i, group in enumerate(m.groups()):
+            if not group:
+                continue
+            try:
+                func = scanner.index2func[i]
+            except KeyError:
+                continue
+            begin, end = m.span()
+            tok = func(group, begin, end)
+            if tok:
+                yield tok
+        pos = end
+
+
+def scanner():
+    source = SPEC * 1000
+    count = len(list(Scanner().tokenize(source)))
+    before = best(lambda: list(groupsTokenize(Scanner(), source)))
+    after = best(lambda: list(Scanner().tokenize(source)))
+    print 'Scanner, %d tokens:' % count
+    print '    groups loop      %8.0f tokens/s' % (count / before)
+    print '    tokenize()       %8.0f tokens/s' % (count / after)
+
+    # Scanner() used to reflect() its pattern and compile it (from re's
+    # cache, mostly) every time as well.
+    n = 1000
+    before = best(lambda: [
+        re.compile(Scanner().reflect(), re.VERBOSE) for i in xrange(n)])
+    after = best(lambda: [Scanner() for i in xrange(n)])
+    print 'Scanner():'
+    print '    reflecting       %8.1f us' % (before / n * 1e6)
+    print '    shared pattern   %8.1f us' % (after / n * 1e6)
+
+
+def nested(depth, leaves=3):
+    '''
+    Return the source of a frame with frames nested depth deep inside it,
+    each holding a few leaf widgets as well.
+    '''
+    leaf = 'label text = "a label" sticky = nsew row = 1 .\n' * leaves
+    return 'frame\n%s' % leaf * depth + '.\n' * depth
+
+
+def memory():
+    source = nested(25) * 150
+    gc.collect()
+    gc.disable()
+    try:
+        rss = resource and resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        t = time.time()
+        elements = list(iterXML(source, 'fast'))
+        t = time.time() - t
+        count = sum(1 for e in elements for e in e.iter())
+        if resource:
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss
+        del elements
+    finally:
+        gc.enable()
+    cyclic = gc.collect()
+    print 'Parsing %d elements (gc disabled):' % count
+    print '    time             %8.2f s' % t
+    if resource:
+        print '    peak RSS growth  %8.0f MB' % (rss / 1024.0) # KB on Linux
+    print '    left for the gc  %8d objects' % cyclic
+
+
+def windows(count=100):
+    try:
+        root = Tkinter.Tk()
+    except Tkinter.TclError:
+        root = None # No display.
+    if root is None:
+        backend = 'RecordingBackend'
+        def window(make):
+            recording = RecordingBackend()
+            make(recording.root, recording)
+    else:
+        root.withdraw()
+        backend = 'Tk'
+        def window(make):
+            top = Tkinter.Toplevel(root)
+            make(top, TK)
+            top.destroy()
+    namespace = dict(RedCallback=lambda event: None,
+                     GreenCallback=lambda event: None)
+
+    def parsing(master, backend):
+        for element in toXML(SPEC, 'fast', 'none'):
+            realize(master, element, dict(namespace), backend)
+
+    def planned(master, backend):
+        PLANS.plan(SPEC, 'fast').instantiate(master, dict(namespace), backend)
+
+    def run(make):
+        PLANS.clear()
+        for i in xrange(count):
+            window(make)
+
+    before = best(lambda: run(parsing))
+    after = best(lambda: run(planned))
+    if root is not None:
+        root.destroy()
+    print '%d windows (%s):' % (count, backend)
+    print '    toXML+realize    %8.1f ms' % (before * 1e3)
+    print '    PLANS            %8.1f ms' % (after * 1e3)
+
+
+BENCHMARKS = [
+    ('scanner', scanner),
+    ('memory', memory),
+    ('windows', windows),
+    ]
+
+
+def main(names):
+    for name, benchmark in BENCHMARKS:
+        if not names or name in names:
+            benchmark()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
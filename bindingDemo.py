@@ -8,10 +8,11 @@ resulting widgets will automatically get those events bound to those
 functors.  This gives you a quick way to connect your widgets to your
 callbacks.
 
-Note that currently including these event specs, with their angle-brackets,
-in a widget spec causes ElementTree to emit invalid XML if you convert an
-ElementTree element to text.  This will be fixed in a future version.
-(If it's bothering you now, feel free to ask me to fix it sooner. -sf)
+Note that these event specs, with their angle-brackets, aren't valid XML
+attribute names, so ElementTree emits invalid XML if you convert such an
+element to text with ET.tostring().  Use pygoo's dumpXML() to write your
+elements to an XML file instead, it encodes the binding keys (<Button-1>
+becomes bind.Button-1) and loadXML() decodes them again.
 
 '''
 from Tkinter import Tk, Frame
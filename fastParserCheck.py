@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+'''
+Check that the 'fast' engine (FastParser) parses just like the 'earley'
+one (Parser) does, by running both over a corpus of generated specs and
+comparing the ElementTree output, the tokens each element was made from,
+and the ParseErrors.  Some of the specs have tokens dropped or repeated,
+so the engines have to agree about bad input too.
+
+Run it again whenever you change the grammar or FastParser:
+
+    python fastParserCheck.py [count [seed]]
+
+It prints the specs the engines disagree about and exits with status 1
+if there are any.
+'''
+import sys
+import random
+from pygoo import Scanner, Parser, FastParser, Formatter, ParseError, Token
+
+
+KEYS = '''
+    text width height sticky row column rowspan padx name relief
+    <Button-1> <Enter>
+    '''.split()
+VALUES = ['nsew', '1', '2', '"A string value"', 'cb', 'mickey', '"x y"', 'red']
+TAGS = 'button label text entry'.split()
+
+
+def spec(rng, n, depth):
+    '''
+    Return the source of a random spec with n top-level elements, frames
+    nested up to depth deep, and maybe some macros.
+    '''
+    lines = []
+    if rng.random() < .5:
+        lines.append('mickey = minnie')
+        lines.append('red = "dark red"')
+    for i in range(n):
+        lines.append(element(rng, depth))
+    return '\n'.join(lines)
+
+
+def element(rng, depth):
+    if depth and rng.random() < .4:
+        tag = 'frame'
+    else:
+        tag = rng.choice(TAGS)
+    lines = [tag]
+    for i in range(rng.randint(0, 4)):
+        lines.append('%s = %s' % (rng.choice(KEYS), rng.choice(VALUES)))
+    if tag == 'frame':
+        for i in range(rng.randint(0, 3)):
+            lines.append(element(rng, depth - 1))
+    lines.append('.')
+    return '\n'.join(lines)
+
+
+def mutate(rng, tokens):
+    '''
+    Drop or repeat a couple of the tokens, or leave them alone.
+    '''
+    tokens = list(tokens)
+    for i in range(rng.randint(0, 2)):
+        k = rng.randrange(len(tokens))
+        if rng.random() < .5:
+            del tokens[k]
+        else:
+            t = tokens[rng.randrange(len(tokens))]
+            tokens.insert(k, Token(t.type, t.attr, t.begin, t.end))
+    return tokens
+
+
+def dump(element):
+    '''
+    Everything about an element and its subelements that the engines
+    have to agree on.
+    '''
+    ast = getattr(element, 'ast', None) # Grid subelements have none.
+    return (
+        element.tag,
+        sorted(element.attrib.items()),
+        element.text,
+        ast and sorted((t.begin, t.end) for t in ast.tokens),
+        [dump(subelement) for subelement in element],
+        )
+
+
+def parse(engine, tokens):
+    try:
+        macros, elements = engine().parse(tokens)
+        return [dump(e) for e in Formatter(macros).convert(elements)]
+    except ParseError:
+        return 'ParseError'
+
+
+def main(count=3000, seed=5):
+    rng = random.Random(seed)
+    disagreements = 0
+    for i in range(count):
+        source = spec(rng, rng.randint(1, 4), 3)
+        tokens = mutate(rng, Scanner().tokenize(source))
+        earley = parse(Parser, tokens)
+        fast = parse(FastParser, tokens)
+        if earley != fast:
+            disagreements += 1
+            print 'Engines disagree about:', tokens
+            print '  earley:', earley
+            print '  fast:  ', fast
+    print '%d specs, %d disagreements' % (count, disagreements)
+    return disagreements
+
+
+if __name__ == '__main__':
+    sys.exit(main(*map(int, sys.argv[1:])) and 1 or 0)
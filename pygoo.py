@@ -19,72 +19,155 @@ pygoo.py - Version 0.1 - Render a widget spec to Tkinter widgets.
     along with this program; if not, see <http://www.gnu.org/licenses/>.
 
 '''
+import os
+import re
+import sys
+import stat
+import imp
+import mmap
+import array
+import struct
+import time
+import types
+import bisect
+import fnmatch
+import optparse
+import tempfile
+import weakref
+from itertools import chain, islice, izip
+import multiprocessing
 import Tkinter
+import spark
 from spark import GenericScanner, GenericParser
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
 try:
     import xml.etree.ElementTree as ET
 except ImportError:
     import elementtree.ElementTree as ET
+from xml.sax.saxutils import escape, quoteattr
+
+__version__ = '0.1'
 
 E = ET.Element
 S = ET.SubElement
 
 
+# Where pygoo keeps things it can rebuild but would rather not, e.g. the
+# parser's grammar state machine.  Set PYGOO_CACHE_DIR to move it.  It's
+# per user because what's in it is trusted (unpickled), see _cacheDir().
+CACHE_DIR = os.environ.get('PYGOO_CACHE_DIR') or os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or
+    os.path.join(os.path.expanduser('~'), '.cache'),
+    'pygoo')
+
+
+def _cacheDir(directory):
+    '''
+    Make the cache directory, readable and writable only by this user,
+    if it isn't there, and return whether it's safe to use: a directory
+    (not a link to one) owned by this user that nobody else can write
+    to, so nobody else can have put anything in it.
+    '''
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0700)
+        st = os.lstat(directory)
+    except OSError:
+        return False
+    if not stat.S_ISDIR(st.st_mode):
+        return False
+    if hasattr(os, 'getuid') and st.st_uid != os.getuid():
+        return False
+    return not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
 #########################################################################
 ## Scanner
 #########################################################################
 
 
-class Token:
-    def __init__(self, type_, attr, begin, end):
+class Token(object):
+    __slots__ = 'type', 'attr', 'begin', 'end', 'index'
+
+    def __init__(self, type_, attr, begin, end, index=None):
         self.type = type_
         self.attr = attr
         self.begin = begin
         self.end = end
+        self.index = index # Position in the Scanner's token stream.
 
     def __cmp__(self, o):
         return cmp(self.type, o)
 
-    def __hash__(self):
-        return hash((self.type, self.attr, self.begin, self.end, id(self)))
+    # Tokens are only ever equal to themselves.
+    __hash__ = object.__hash__
 
     def __repr__(self):
         return '<Tok %s, %s>' % (self.type, self.attr)
 
 
+class LexicalError(Exception):
+    '''
+    Raised by the Scanner on input it can't tokenize, pos is the offset
+    of the offending text.
+    '''
+    def __init__(self, message, pos):
+        Exception.__init__(self, message)
+        self.pos = pos
+
+
 class Scanner(GenericScanner):
     ops = {
         '=': 'EQ',
         ':': 'EL',
         '.': 'STOP',
         }
-    
-    def tokenize(self, input_):
-        pos = 0
-        n = len(input_)
-        while pos < n:
-
-            m = self.re.match(input_, pos)
-            if m is None:
-                self.error(input_, pos)
-
-            for i, group in enumerate(m.groups()):
 
-                if not group:
-                    continue
+    def __init__(self, flags=0):
+        # GenericScanner compiles the pattern once per class.
+        GenericScanner.__init__(self, flags)
+        self.name2func = dict(
+            (name, getattr(self, 't_' + name))
+            for name in self.re.groupindex
+            )
 
-                try:
-                    func = self.index2func[i]
-                except KeyError:
-                    continue
+    def tokenize(self, input_, pos=0, endpos=None):
+        '''
+        Yield the Tokens in input_ (or just in input_[pos:endpos].)  The
+        whole input is matched with one finditer() call and each match is
+        dispatched on its group name.
+        '''
+        if endpos is None:
+            endpos = len(input_)
+        name2func = self.name2func
+        index = 0
+        for m in self.re.finditer(input_, pos, endpos):
+            begin, end = m.span()
+            if begin != pos:
+                self.error(input_, pos)
+            tok = name2func[m.lastgroup](m.group(), begin, end)
+            if tok:
+                tok.index = index
+                index += 1
+                yield tok
+            pos = end
 
-                begin, end = m.span()
+        if pos < endpos:
+            self.error(input_, pos)
 
-                tok = func(group, begin, end)
-                if tok:
-                    yield tok
+    def error(self, s, pos):
+        raise LexicalError("Lexical error at position %s" % pos, pos)
 
-            pos = end
+    def t_default(self, s, begin, end):
+        r'( . | \n )+'
+        self.error(s, begin)
 
     def t_whitespace(self, s, begin, end):
         r'\s+ '
@@ -94,15 +177,18 @@ class Scanner(GenericScanner):
         r'[=.]'
         return Token(s, self.ops[s], begin, end)
 
+    # Symbols and strings are interned so the keys and values repeated
+    # all through a spec (sticky, row, nsew...) are stored just once.
+
     def t_symbol(self, s, begin, end):
         r'[^=.\s]+'
-        return Token('symbol', s, begin, end)
+        return Token('symbol', intern(s), begin, end)
 
     def t_string(self, s, begin, end):
         r'"(.*?)(?<!\\)"'
         assert s.startswith('"') and s.endswith('"')
         s = s[1:-1]
-        return Token('string', s, begin, end)
+        return Token('string', intern(s), begin, end)
 
 
 #########################################################################
@@ -110,19 +196,64 @@ class Scanner(GenericScanner):
 #########################################################################
 
 
-class AST:
+class AST(object):
+    '''
+    A parsed eq or el.  The tokens passed in are only the node's own
+    (key, EQ and value for an eq, symbol and STOP for an el) and they
+    give the node's source span, (begin, end), and tokenRange, the
+    [start, stop) indices of all its tokens in the Scanner's stream.
+    The set of all the node's tokens is built on request by the tokens
+    property.
+
+    The parent link is a weak reference so a parsed spec has no
+    reference cycles and is freed as soon as it is dropped.
+    '''
+
+    __slots__ = (
+        'type', 'tag', 'els', 'eqs', 'own', 'span', 'tokenRange',
+        '_parent', '__weakref__',
+        )
+
     def __init__(self, type_, tag, els=None, eqs=None, tokens=None):
         self.type = type_
         self.tag = tag
         self.els = els or []
         self.eqs = eqs or []
-        self.tokens = tokens and set(tokens) or set()
-        self.parent = None
+        self.own = tokens and tuple(tokens) or ()
+        self.span = self.tokenRange = None
+        if self.own:
+            first, last = self.own[0], self.own[-1]
+            self.span = first.begin, last.end
+            if first.index is not None and last.index is not None:
+                self.tokenRange = first.index, last.index + 1
+        self._parent = None
         for ast in self.els:
             if not ast.parent is None:
                 raise Exception(('ast already has parent!', ast))
             ast.parent = self
 
+    def _getParent(self):
+        if self._parent is not None:
+            return self._parent()
+
+    def _setParent(self, parent):
+        if parent is not None:
+            parent = weakref.ref(parent)
+        self._parent = parent
+
+    parent = property(_getParent, _setParent)
+
+    @property
+    def tokens(self):
+        tokens = set()
+        nodes = [self]
+        while nodes:
+            node = nodes.pop()
+            tokens.update(node.own)
+            nodes.extend(node.eqs)
+            nodes.extend(node.els)
+        return tokens
+
     def __getitem__(self, i): return self.eqs[i]
 
     def __repr__(self):
@@ -140,37 +271,120 @@ class ParseError(Exception):
 
 class Parser(GenericParser):
 
+    # Fully built grammar state machines, keyed by _grammarKey().
+    _grammars = {}
+
     def __init__(self, start='begin'):
-        GenericParser.__init__(self, start)
+        '''
+        Build the parser from the grammar state machine that was built
+        once for this process (or loaded from CACHE_DIR) rather than
+        re-deriving it from the p_* docstrings every time.
+        '''
+        key = self._grammarKey(start)
+        state = self._grammars.get(key) or self._loadGrammar(key)
+
+        if state is None:
+            GenericParser.__init__(self, start)
+            # Pickling support in GenericParser generates the complete
+            # state machine, that's just what we want to keep around.
+            state = self.__getstate__()
+            self._saveGrammar(key, state)
+
+        self._grammars[key] = state
+        # Restoring the state selects makeSet_fast() for us.
+        self.__setstate__(dict(state))
+
+    def _grammarKey(self, start):
+        rules = [start, spark.__version__]
+        for name in sorted(dir(self)):
+            if name[:2] == 'p_':
+                rules.append(name)
+                rules.append(getattr(self, name).__doc__)
+        return sha1('\0'.join(rules)).hexdigest()
+
+    def _grammarPath(self, key):
+        return os.path.join(CACHE_DIR, 'grammar-%s.pickle' % key)
+
+    def _loadGrammar(self, key):
+        if not _cacheDir(CACHE_DIR):
+            return None
+        try:
+            f = open(self._grammarPath(key), 'rb')
+            try:
+                return pickle.load(f)
+            finally:
+                f.close()
+        except Exception:
+            # Missing, stale or unreadable cache, just rebuild it.
+            return None
+
+    def _saveGrammar(self, key, state):
+        if not _cacheDir(CACHE_DIR):
+            return
+        try:
+            fd, temp = tempfile.mkstemp(dir=CACHE_DIR)
+            f = os.fdopen(fd, 'wb')
+            try:
+                pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            os.rename(temp, self._grammarPath(key))
+        except (IOError, OSError):
+            pass # The cache is only an optimization.
 
     def iterparse(self, tokens):
-        tokens = iter(tokens)
+        '''
+        Yield the macros list and then each top-level element AST as
+        soon as the STOP token closing it arrives.
+
+        Top-level element boundaries are found in a single pass by
+        keeping track of the nesting depth (a symbol not followed by an
+        EQ opens an element, a STOP closes one) so each element's tokens
+        are handed to the Earley parser exactly once.
+        '''
         accumulator = []
+        depth = 0
+        first = True
+        previous = None # Last symbol token, if it wasn't a value.
 
         for token in tokens:
             accumulator.append(token)
-            try:
-                macros, elements = GenericParser.parse(self, accumulator)
-            except ParseError:
+
+            if previous is not None and token != '=':
+                depth += 1
+            previous = None
+
+            if token == 'symbol':
+                if len(accumulator) < 2 or accumulator[-2] != '=':
+                    previous = token
                 continue
-            yield macros
-            if elements:
-                yield elements[0]
-            break
 
-        accumulator = []
-        for token in tokens:
-            accumulator.append(token)
-            try:
-                macros, elements = GenericParser.parse(self, accumulator)
-            except ParseError:
+            if token != '.':
+                continue
+
+            depth -= 1
+            if depth > 0:
                 continue
-            yield elements[0]
+
+            macros, elements = GenericParser.parse(self, accumulator)
+            if first:
+                yield macros
+                first = False
+            elif macros:
+                self.error(accumulator[0]) # Macros only come first.
+            for element in elements:
+                yield element
+
             accumulator = []
+            depth = 0
 
         if accumulator:
             raise ParseError("Leftover tokens: %s" % accumulator)
 
+    def typestring(self, token):
+        # Lets makeSet_fast() find transitions straight from the edges.
+        return token.type
+
     def error(self, token):
         raise ParseError("Syntax error at or near `%s' token" % token)
 
@@ -195,9 +409,8 @@ class Parser(GenericParser):
             eq ::= symbol = string
             eq ::= symbol = symbol
         '''
-        tokens = self._collectTokens(args)
         KEY, _, VALUE = args
-        return AST('EQ', (KEY.attr, VALUE.attr), tokens=tokens)
+        return AST('EQ', (KEY.attr, VALUE.attr), tokens=args)
 
     def p_eqlist(self, args):
         '''
@@ -213,8 +426,6 @@ class Parser(GenericParser):
             el ::= symbol ellist .
             el ::= symbol eqlist ellist .
         '''
-        tokens = self._collectTokens(args)
-
         el, stop = args[0], args.pop()
 
         n = len(args)
@@ -234,7 +445,7 @@ class Parser(GenericParser):
         else:
             EQs, ELs = args[1:]
 
-        return AST('EL', el.attr, ELs, EQs, tokens)
+        return AST('EL', el.attr, ELs, EQs, (el, stop))
 
     def _enlist(self, args):
         if len(args) == 1:
@@ -243,21 +454,101 @@ class Parser(GenericParser):
         L.append(thing)
         return L
 
-    def _collectTokens(self, args):
-        tokens = set()
-        for thing in args:
-            if isinstance(thing, Token):
-                tokens.add(thing)
 
-            elif isinstance(thing, AST):
-                tokens.update(thing.tokens)
+class FastParser:
+    '''
+    Deterministic parser for the pygoo grammar.
+
+    The grammar is simple enough that a symbol followed by an EQ token
+    is always the key of an eq and any other symbol always opens an el,
+    so this builds the same AST nodes (and tokens) as Parser does, with
+    an explicit stack of open elements instead of an Earley chart.  Use
+    Parser if you extend the grammar.
+    '''
+
+    def parse(self, tokens):
+        asts = self.iterparse(tokens)
+        try:
+            macros = asts.next()
+        except StopIteration:
+            self.error(None)
+        return macros, list(asts)
+
+    def iterparse(self, tokens):
+        '''
+        Yield the macros list and then each top-level element AST as
+        soon as the STOP token closing it arrives, like Parser.iterparse.
+        '''
+        tokens = iter(tokens)
+        pending = [] # Tokens of the current top-level element.
+        macros = []
+        first = True
+        stack = [] # [symbol token, eqs, els]
+
+        token = next(tokens, None)
+        while token is not None:
+            pending.append(token)
 
-            elif isinstance(thing, list):
-                tokens.update(self._collectTokens(thing))
+            if token == 'symbol':
+                following = next(tokens, None)
+
+                if following != '=':
+                    stack.append([token, [], []])
+                    token = following
+                    continue
+
+                value = next(tokens, None)
+                if value != 'symbol' and value != 'string':
+                    self.error(value or following)
+                pending.append(following)
+                pending.append(value)
+                eq = AST(
+                    'EQ',
+                    (token.attr, value.attr),
+                    tokens=(token, following, value),
+                    )
+
+                if not stack:
+                    if not first:
+                        self.error(token)
+                    macros.append(eq)
+                elif stack[-1][2]:
+                    self.error(token) # eqs must come before els.
+                else:
+                    stack[-1][1].append(eq)
+
+            elif token == '.':
+                if not stack:
+                    self.error(token)
+                el, EQs, ELs = stack.pop()
+                ast = AST('EL', el.attr, ELs, EQs, (el, token))
+
+                if stack:
+                    stack[-1][2].append(ast)
+                else:
+                    if first:
+                        yield macros
+                        first = False
+                    yield ast
+                    pending = []
 
             else:
-                raise TypeError(thing)
-        return tokens
+                self.error(token)
+
+            token = next(tokens, None)
+
+        if pending:
+            raise ParseError("Leftover tokens: %s" % pending)
+
+    def error(self, token):
+        raise ParseError("Syntax error at or near `%s' token" % token)
+
+
+# Parsers toXML() can use, see FastParser.
+ENGINES = {
+    'earley': Parser,
+    'fast': FastParser,
+    }
 
 
 #########################################################################
@@ -265,7 +556,109 @@ class Parser(GenericParser):
 #########################################################################
 
 
+# How much of its source an element remembers, see Formatter.
+PROVENANCE = ('none', 'span', 'tokens')
+
+
+class Component:
+    '''
+    A reusable, parameterised element, defined in a spec by a top-level
+    component element.  Its name attribute names the component, its
+    other attributes are the parameters and their default values, and
+    its one subelement is the body:
+
+        component
+            name = field
+            text = "Name:"
+            row = 0
+            frame
+                row = row
+                label text = text .
+                entry column = 1 .
+            .
+        .
+
+        field text = "Age:" row = 1 .
+
+    An element whose tag is a component's name is an instance of it: a
+    copy of the body with the instance's parameters substituted wherever
+    a body attribute's value is a parameter name (like macros), and the
+    instance's other attributes and subelements added to the copy.
+
+    The body is compiled once into the template element and a flat list
+    of records that instantiate() copies, so an instance costs time in
+    proportion to its size, the spec isn't parsed again.
+    '''
+
+    def __init__(self, name, params, template):
+        self.name = name
+        self.params = params
+        self.template = template
+
+        # Preorder (tag, attrib, number of children, substitution sites)
+        self.records = records = []
+        stack = [template]
+        while stack:
+            e = stack.pop()
+            sites = [
+                (key, value)
+                for key, value in e.attrib.iteritems()
+                if value in params
+                ]
+            records.append((e.tag, e.attrib, len(e), sites))
+            stack.extend(reversed(e))
+
+    def instantiate(self, parent, args):
+        '''
+        Return a new copy of the body, as a subelement of parent unless
+        it's None, with the parameters in the args dict (or their default
+        values) substituted.
+        '''
+        values = self.params
+        if args:
+            values = values.copy()
+            values.update(args)
+
+        root = None
+        stack = [] # [element, number of children still to come]
+        for tag, attrib, n, sites in self.records:
+            if sites:
+                attrib = attrib.copy()
+                for key, param in sites:
+                    attrib[key] = values[param]
+            if stack:
+                top = stack[-1]
+                e = S(top[0], tag, attrib)
+                top[1] -= 1
+                if not top[1]:
+                    stack.pop()
+            elif parent is None:
+                e = root = E(tag, attrib)
+            else:
+                e = root = S(parent, tag, attrib)
+            if n:
+                stack.append([e, n])
+        return root
+
+
+def _componentError(name):
+    raise ParseError(
+        "Component %s must have a name and exactly one element" % (name,))
+
+
 class Formatter:
+    '''
+    Convert parsed ASTs into ElementTree elements.
+
+    provenance - 'tokens' (the default) sets each element's ast
+        attribute to the AST it came from, 'span' only sets its span
+        attribute to the (begin, end) offsets of its source text and
+        'none' keeps no link to the source at all.  The subelements
+        copied from a component's body have no provenance.
+
+    Top-level component elements define the components, see Component,
+    and aren't converted themselves.
+    '''
 
     _GRID_SETTINGS = set('''
         sticky
@@ -275,29 +668,125 @@ class Formatter:
         rowspan columnspan
         '''.split())
 
-    def __init__(self, macros):
+    def __init__(self, macros, provenance='tokens'):
+        if provenance not in PROVENANCE:
+            raise ValueError('Unknown provenance: %r' % (provenance,))
         self.macros = dict(eq.tag for eq in macros)
+        self.provenance = provenance
         self.parent = None
+        self.components = {}
 
     def convert(self, elements):
         for el in elements:
-            yield self.el(el)
+            if el.tag == 'component':
+                self.define(el)
+            else:
+                yield self.el(el)
 
     def el(self, node):
-        parent = self.parent
+        for event, e in self.iterevents((node,)):
+            pass
+        return e
 
-        if parent is None:
-            e = E(node.tag)
+    def iterevents(self, elements):
+        '''
+        Convert the element ASTs, yielding ('start', element) as each
+        element is created (with its attributes and grid already set)
+        and ('end', element) once all its subelements are done, like
+        ET.iterparse() does.  The tree is walked with an explicit stack,
+        so there's no limit on the nesting depth.
+
+        Elements are appended to their parents as usual, call clear()
+        on an element at its 'end' event to drop its subtree if you only
+        want to scan the spec.
+        '''
+        base = self.parent
+        for node in elements:
+            if base is None and node.tag == 'component':
+                self.define(node)
+                continue
+            e = self._start(node)
+            for event in _startEvents(e):
+                yield event
+            stack = [(e, iter(node.els))]
+
+            while stack:
+                e, els = stack[-1]
+                for node in els:
+                    self.parent = e
+                    e = self._start(node)
+                    for event in _startEvents(e):
+                        yield event
+                    stack.append((e, iter(node.els)))
+                    break
+                else:
+                    stack.pop()
+                    yield 'end', e
+
+            self.parent = base
+
+    def define(self, node):
+        '''
+        Compile the component defined by node and return it, see
+        Component.
+        '''
+        name = None
+        params = {}
+        for eq in node.eqs:
+            key, value = eq.tag
+            if key == 'name':
+                name = value
+            else:
+                params[key] = self.macros.get(value, value)
+        if name is None or len(node.els) != 1:
+            _componentError(name)
+        body = node.els[0]
+        if body.tag == 'component':
+            _componentError(name)
+
+        # Parameters shadow macros in the body.
+        state = self.macros, self.provenance, self.parent
+        self.macros = dict(
+            item for item in self.macros.iteritems() if item[0] not in params)
+        self.provenance = 'none'
+        self.parent = None
+        try:
+            template = self.el(body)
+        finally:
+            self.macros, self.provenance, self.parent = state
+
+        component = self.components[name] = Component(name, params, template)
+        return component
+
+    def _start(self, node):
+        parent = self.parent
+        component = self.components.get(node.tag)
+
+        if component is not None:
+            args = {}
+            eqs = []
+            for eq in node.eqs:
+                key, value = eq.tag
+                if key in component.params:
+                    args[key] = self.macros.get(value, value)
+                else:
+                    eqs.append(eq)
+            e = component.instantiate(parent, args)
         else:
-            e = S(parent, node.tag)
+            eqs = node.eqs
+            if parent is None:
+                e = E(node.tag)
+            else:
+                e = S(parent, node.tag)
 
         self.parent = e
-        e.ast = node
+        if self.provenance == 'tokens':
+            e.ast = node
+        elif self.provenance == 'span':
+            e.span = node.span
 
-        for eq in node.eqs:
+        for eq in eqs:
             self.eq(eq)
-        for el in node.els:
-            self.el(el)
 
         self.parent = parent
 
@@ -319,105 +808,2629 @@ class Formatter:
         D[key] = value
 
 
-def toXML(source):
+def _startEvents(e):
+    # The start of an element that was just created, along with the
+    # subelements it already has: its grid, or a component's body.
+    yield 'start', e
+    for child in e:
+        for event in _walk(child):
+            yield event
+
+
+def _walk(element):
+    '''
+    Yield ('start', e) and ('end', e) events for a finished element and
+    all its subelements, without recursion.
+    '''
+    yield 'start', element
+    stack = [(element, iter(element))]
+    while stack:
+        e, children = stack[-1]
+        for child in children:
+            yield 'start', child
+            stack.append((child, iter(child)))
+            break
+        else:
+            stack.pop()
+            yield 'end', e
+
+
+class Builder:
+    '''
+    Build ElementTree elements straight from the tokens, in one pass.
+
+    This fuses FastParser and Formatter: there are no ASTs, macros are
+    substituted as the values are read and each open element keeps a
+    handle on its grid subelement instead of looking it up.  Without
+    ASTs the only provenance available is 'span' or 'none'.
+
+    Components work as in Formatter.  An instance's element is only made
+    once all its parameters are known, when its first subelement or its
+    STOP token arrives.
+    '''
+
+    _GRID_SETTINGS = Formatter._GRID_SETTINGS
+
+    def __init__(self, provenance='none'):
+        if provenance not in ('none', 'span'):
+            raise ValueError('Unknown provenance: %r' % (provenance,))
+        self.provenance = provenance
+
+    def build(self, tokens):
+        '''
+        Yield each top-level element as soon as its STOP token arrives.
+        '''
+        tokens = iter(tokens)
+        grid_settings = self._GRID_SETTINGS
+        spans = self.provenance == 'span'
+        macros = {}
+        components = {}
+        values = macros # Substituted for the values read.
+        first = True
+        # [element, its grid or None, has els?, symbol token, instance]
+        # where instance is None or [parent, component, eqs] until the
+        # instance's element is made.
+        stack = []
+
+        token = next(tokens, None)
+        while token is not None:
+
+            if token == 'symbol':
+                following = next(tokens, None)
+
+                if following != '=':
+                    tag = token.attr
+                    if stack:
+                        top = stack[-1]
+                        if not top[2]:
+                            top[2] = True
+                            if top[4]:
+                                self._instantiate(top)
+                            elif len(stack) == 1 and top[0].tag == 'component':
+                                # Parameters shadow macros in the body.
+                                params = top[0].attrib
+                                values = dict(
+                                    item for item in macros.iteritems()
+                                    if item[0] == 'name'
+                                    or item[0] not in params)
+                        parent = top[0]
+                    else:
+                        parent = None
+                    component = components.get(tag)
+                    if component is not None:
+                        stack.append(
+                            [None, None, False, token, [parent, component, []]])
+                    else:
+                        if parent is None:
+                            e = E(tag)
+                        else:
+                            e = S(parent, tag)
+                        stack.append([e, None, False, token, None])
+                    token = following
+                    continue
+
+                value = next(tokens, None)
+                if value != 'symbol' and value != 'string':
+                    self.error(value or following)
+                key, value = token.attr, value.attr
+
+                if not stack:
+                    if not first:
+                        self.error(token)
+                    macros[key] = value
+                    token = next(tokens, None)
+                    continue
+
+                top = stack[-1]
+                if top[2]:
+                    self.error(token) # eqs must come before els.
+
+                if top[4]:
+                    top[4][2].append((key, values.get(value, value)))
+                elif len(stack) == 1 and top[0].tag == 'component':
+                    if key != 'name':
+                        value = values.get(value, value)
+                    top[0].attrib[key] = value
+                elif key in grid_settings:
+                    value = values.get(value, value)
+                    grid = top[1]
+                    if grid is None:
+                        grid = top[1] = S(top[0], 'grid')
+                    grid.attrib[key] = value
+                else:
+                    top[0].attrib[key] = values.get(value, value)
+
+            elif token == '.':
+                if not stack:
+                    self.error(token)
+                top = stack.pop()
+                if top[4]:
+                    self._instantiate(top)
+                e = top[0]
+                if spans:
+                    e.span = top[3].begin, token.end
+                if not stack:
+                    first = False
+                    if e.tag == 'component' and top[4] is None:
+                        component = self._define(e)
+                        components[component.name] = component
+                        values = macros
+                    else:
+                        yield e
+
+            else:
+                self.error(token)
+
+            token = next(tokens, None)
+
+        if stack or macros and first:
+            raise ParseError("Leftover tokens at end of input")
+
+    def error(self, token):
+        raise ParseError("Syntax error at or near `%s' token" % token)
+
+    def _instantiate(self, top):
+        parent, component, eqs = top[4]
+        top[4] = None
+        args = {}
+        params = component.params
+        for key, value in eqs:
+            if key in params:
+                args[key] = value
+        e = top[0] = component.instantiate(parent, args)
+        grid = e.find('grid')
+        for key, value in eqs:
+            if key in params:
+                continue
+            if key in self._GRID_SETTINGS:
+                if grid is None:
+                    grid = S(e, 'grid')
+                grid.attrib[key] = value
+            else:
+                e.attrib[key] = value
+        top[1] = grid
+
+    def _define(self, e):
+        params = dict(e.attrib)
+        name = params.pop('name', None)
+        if name is None or len(e) != 1 or e[0].tag == 'component':
+            _componentError(name)
+        return Component(name, params, e[0])
+
+
+def toXML(source, engine='earley', provenance=None):
+    '''
+    Convert source to a list of ElementTree elements, using the parser
+    named by engine (see ENGINES) and keeping the given provenance (see
+    Formatter.)  The 'fused' engine skips the ASTs altogether, see
+    Builder.  The provenance is 'tokens' by default, or 'none' with the
+    'fused' engine, which can't keep tokens.  Like the others, the 'fused'
+    engine raises ParseError if source has no tokens at all.
+    '''
+    provenance = _provenance(engine, provenance)
     tokens = Scanner().tokenize(source)
+    if engine == 'fused':
+        first = next(tokens, None)
+        if first is None:
+            raise ParseError("Syntax error at or near `None' token")
+        return list(Builder(provenance).build(chain((first,), tokens)))
     tokens = list(tokens)
-    macros, elements = Parser().parse(tokens)
-    return list(Formatter(macros).convert(elements))
+    macros, elements = ENGINES[engine]().parse(tokens)
+    return list(Formatter(macros, provenance).convert(elements))
 
 
-#########################################################################
-## Convert ElementTree elements into Tkinter widgets.
-#########################################################################
+def iterXML(source, engine='earley', provenance=None):
+    '''
+    Yield the ElementTree elements of source one at a time, as soon as
+    each top-level element has been parsed.  The source can be anything
+    the Scanner's regular expression can search, a string or an mmap for
+    instance.
+    '''
+    provenance = _provenance(engine, provenance)
+    tokens = Scanner().tokenize(source)
+    if engine == 'fused':
+        for element in Builder(provenance).build(tokens):
+            yield element
+        return
+    asts = ENGINES[engine]().iterparse(tokens)
+    for macros in asts:
+        for element in Formatter(macros, provenance).convert(asts):
+            yield element
 
 
-def realize(master, element, namespace=None):
+def iterevents(source, engine='earley', provenance=None):
     '''
-    Grok XML description into actual widgets.
+    Yield ('start', element) and ('end', element) events for the spec in
+    source, like ET.iterparse(), see Formatter.iterevents().  Top-level
+    elements aren't kept anywhere, so a consumer that clears elements at
+    their 'end' events scans a spec of any size in bounded memory.
 
-    master - Tkinter container widget to use as this widget's parent.
-    element - ElementTree Element describing the desired widget.
-    namespace - [Optional] a namespace to bind child widgets to, if their
-        'name' attribute is specified in the element XML.  (Hint: pass a
-        class's __dict__ object to have widgets available as attributes
-        of their instance.  See the example below.)
+    The 'fused' engine builds each top-level element completely before
+    its events are generated.
+    '''
+    provenance = _provenance(engine, provenance)
+    tokens = Scanner().tokenize(source)
+    if engine == 'fused':
+        for element in Builder(provenance).build(tokens):
+            for event in _walk(element):
+                yield event
+        return
+    asts = ENGINES[engine]().iterparse(tokens)
+    for macros in asts:
+        for event in Formatter(macros, provenance).iterevents(asts):
+            yield event
+
+
+def _provenance(engine, provenance):
+    # The provenance to keep if None was asked for: the tokens, if the
+    # engine makes ASTs to keep them in.
+    if provenance is None:
+        if engine == 'fused':
+            return 'none'
+        return 'tokens'
+    return provenance
+
+
+def mapFile(path):
+    '''
+    Return a read-only memory map of the file at path.
     '''
+    f = open(path, 'rb')
+    try:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return '' # Empty files can't be mapped.
+    finally:
+        f.close()
 
-    if namespace is None:
-        namespace = {}
 
-    bindings, options = _getBindingsAndOptions(element.attrib, namespace)
-    name = element.get('name')
-    grid = None
+def toXMLFile(path, engine='earley', provenance=None):
+    '''
+    Yield the ElementTree elements of the spec in the file at path, as
+    iterXML() does, tokenizing straight out of a memory map of the file
+    rather than reading it into a string first.
 
-    if element.tag.lower() == "frame":
+    Token begin and end values are offsets into the file, so you can
+    recover an element's source text from mapFile(path) without copying
+    the whole file.
+    '''
+    source = mapFile(path)
+    try:
+        for element in iterXML(source, engine, provenance):
+            yield element
+    finally:
+        if source:
+            source.close()
 
-        widget = Tkinter.Frame(master, **options)
 
-        for subelement in element:
+#########################################################################
+## XML files.
+#########################################################################
 
-            if subelement.tag.lower() == "grid":
-                grid = subelement
-                continue
 
-            realize(widget, subelement, namespace)
+# Tags and keys that aren't XML names, like the event specifiers used for
+# bindings, are written as bind.<escaped> (for <...> keys) or name.<escaped>
+# where escaping replaces everything but letters, digits and '-' with _xx
+# hex codes.  Spec symbols can't contain '.' so this can't be ambiguous.
+_XML_NAME = re.compile(r'[A-Za-z_][\w-]*\Z')
+_UNSAFE = re.compile(r'[^A-Za-z0-9-]')
+_ESCAPED = re.compile(r'_([0-9a-f]{2})')
 
+
+def _xmlName(name):
+    if _XML_NAME.match(name):
+        return name
+    if isinstance(name, unicode):
+        name = name.encode('utf-8')
+    if len(name) > 2 and name[0] == '<' and name[-1] == '>':
+        prefix, name = 'bind.', name[1:-1]
     else:
-        if element:
+        prefix = 'name.'
+    return prefix + _UNSAFE.sub(lambda m: '_%02x' % ord(m.group()), name)
 
-            D = dict((n.tag.lower(), n) for n in element)
 
-            grid = D.pop('grid', None)
+def _specName(name):
+    if name.startswith('bind.'):
+        return '<%s>' % _unescapeName(name[5:])
+    if name.startswith('name.'):
+        return _unescapeName(name[5:])
+    return name
 
-            _merge_subelements_to_options(D.values(), options)
 
-        widget_factory = getattr(Tkinter, element.tag.capitalize())
+def _unescapeName(name):
+    return intern(str(
+        _ESCAPED.sub(lambda m: chr(int(m.group(1), 16)), name)))
 
-        widget = widget_factory(master, **options)
 
-    if name: namespace[name] = widget
+def _utf8(s):
+    if isinstance(s, unicode):
+        return s.encode('utf-8')
+    return s
 
-    for event_specifier, callback in bindings.iteritems():
-        widget.bind(event_specifier, callback)
 
-    _grid(widget, grid)
+def dumpXML(elements, file):
+    '''
+    Write elements, from any iterable (iterXML() for instance), to file
+    (a path or a file object) as valid XML: the children of a <pygoo>
+    root element, one per line and with the attributes sorted so the
+    files diff nicely.  Each element is written as soon as it arrives.
+    Binding keys and any other tags or keys that aren't XML names are
+    encoded reversibly, loadXML() reads them back.
+    '''
+    close = isinstance(file, basestring)
+    if close:
+        file = open(file, 'wb')
+    try:
+        write = file.write
+        write('<?xml version="1.0" encoding="utf-8"?>\n<pygoo>\n')
+        for element in elements:
+            depth = 0
+            for event, e in _walk(element):
+                if event == 'end':
+                    if len(e):
+                        write('%s</%s>\n' % ('  ' * depth, _xmlName(e.tag)))
+                    depth -= 1
+                    continue
+                depth += 1
+                write('  ' * depth + '<' + _xmlName(e.tag))
+                for key, value in sorted(e.attrib.iteritems()):
+                    write(' %s=%s' % (
+                        _xmlName(key), _utf8(quoteattr(value))))
+                if e.text:
+                    write('>' + _utf8(escape(e.text)))
+                    if not len(e):
+                        write('</%s>\n' % (_xmlName(e.tag),))
+                        continue
+                elif not len(e):
+                    write(' />\n')
+                    continue
+                else:
+                    write('>')
+                write('\n')
+        write('</pygoo>\n')
+    finally:
+        if close:
+            file.close()
+
 
-    return widget
+def loadXML(file):
+    '''
+    Yield the elements in an XML file (a path or a file object) written
+    by dumpXML(), with their tags and keys decoded, one at a time as
+    each is read.  The elements aren't kept anywhere, so a file of any
+    size loads in bounded memory if you don't keep them either.
+    '''
+    depth = 0
+    root = None
+    for event, e in ET.iterparse(file, ('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = e
+            depth += 1
+            continue
+        depth -= 1
+        if depth != 1:
+            continue
+
+        for sub in e.iter():
+            sub.tag = _specName(sub.tag)
+            attrib = sub.attrib
+            for key in [key for key in attrib if '.' in key]:
+                attrib[_specName(key)] = attrib.pop(key)
+            # Drop the line breaks and indentation dumpXML() added.
+            sub.tail = None
+            text = sub.text
+            if len(sub) and text and '\n' in text:
+                sub.text = text[:text.rindex('\n')] or None
+        root.clear()
+        yield e
 
 
-def _getBindingsAndOptions(options, namespace):
-    bindings, settings = {}, {}
-    for key, value in options.iteritems():
-        if key.startswith('<') and key.endswith('>'):
-            try:
-                bindings[key] = namespace[value]
-            except KeyError:
-##                print 'bad binding: %s := %s' % (key, value)
-                continue
-        else:
-            settings[key] = value
-    return bindings, settings
+#########################################################################
+## Incremental re-parsing.
+#########################################################################
 
 
-def _grid(widget, element):
+class Document:
     '''
-    Collect grid options from element and use them to place the widget
-    using the 'grid' layout manager.
+    A spec kept parsed while it is edited.
+
+    edit() rescans and reparses only the top-level elements the edit
+    touches and reuses the AST and ElementTree objects of all the others,
+    so the cost of an edit depends on the size of the elements it hits,
+    not on the size of the whole spec.  An edit that touches the macros
+    or a component definition (or adds some) can change every element, so
+    the whole spec is reparsed.
+
+    The source, macros, asts and elements attributes are always current,
+    asts holds the ASTs of the elements, not of the component definitions.
+    Reused ASTs keep the token offsets of the text they were parsed from,
+    use span() for the current position of a top-level element.
+
+    The engine has to be one that makes ASTs, so not 'fused'.
     '''
 
-    if element is None:
-        options = {}
+    def __init__(self, source, engine='earley', provenance=None):
+        if engine not in ENGINES:
+            raise ValueError(
+                'Document needs an engine that makes ASTs (one of %s), not %r'
+                % (', '.join(sorted(ENGINES)), engine))
+        self.engine = engine
+        self.provenance = _provenance(engine, provenance)
+        self.valid = False
+        self.elements = []
+        self._reparse(source)
+
+    def span(self, i):
+        '''
+        Return the current (begin, end) offsets of the i'th element.
+        '''
+        return self._begins[i], self._ends[i]
 
-    else:
-        options = element.attrib.copy()
-        _merge_subelements_to_options(element, options)
+    def edit(self, offset, old_len, new_text):
+        '''
+        Replace the old_len characters at offset with new_text and bring
+        the parse up to date.
+
+        Returns (start, removed, added): elements[start:start + added]
+        are new, replacing the removed elements that used to be there,
+        all other elements are the very same objects as before.  Raises
+        ParseError or LexicalError if the edited spec is invalid, the
+        source is updated anyway and the next edit reparses it all.
+        '''
+        end = offset + old_len
+        delta = len(new_text) - old_len
+        source = self.source[:offset] + new_text + self.source[end:]
 
-    widget.grid(**options)
+        if not self.valid or self.macros and offset <= self._macrosEnd:
+            return self._reparse(source)
 
+        begins, ends = self._begins, self._ends
 
-def _merge_subelements_to_options(iterable, options):
+        # Elements touching the edit (even just adjacent to it) get
+        # reparsed along with the whitespace around them.
+        lo = bisect.bisect_left(ends, offset)
+        hi = bisect.bisect_right(begins, end)
+        if lo:
+            begin = ends[lo - 1]
+        else:
+            begin = self._macrosEnd
+        if hi < len(begins):
+            stop = begins[hi] + delta
+        else:
+            stop = len(source)
+
+        components = self._components
+        i = bisect.bisect_left(components, begin)
+        if i < len(components) and components[i] < stop - delta:
+            return self._reparse(source)
+
+        try:
+            macros, asts = self._parse(source, begin, stop)
+        except (ParseError, LexicalError):
+            # An edit that unbalances the elements can change how the
+            # rest of the spec parses.
+            return self._reparse(source)
+        left = len(self.asts) - (hi - lo) + len(asts)
+        if macros or self.macros and not left:
+            # Macros have to come first, and can't come alone.
+            return self._reparse(source)
+        for ast in asts:
+            if ast.tag == 'component':
+                return self._reparse(source)
+
+        # Only the components defined before an element apply to it.
+        formatter = Formatter(self.macros, self.provenance)
+        for component in self._defined[:i]:
+            formatter.components[component.name] = component
+
+        self.source = source
+        self.asts[lo:hi] = asts
+        self.elements[lo:hi] = formatter.convert(asts)
+        components[i:] = [n + delta for n in components[i:]]
+
+        begins[hi:] = [n + delta for n in begins[hi:]]
+        ends[hi:] = [n + delta for n in ends[hi:]]
+        begins[lo:hi] = [ast.span[0] for ast in asts]
+        ends[lo:hi] = [ast.span[1] for ast in asts]
+
+        return lo, hi - lo, len(asts)
+
+    def _parse(self, source, begin=0, end=None):
+        tokens = Scanner().tokenize(source, begin, end)
+        asts = ENGINES[self.engine]().iterparse(tokens)
+        for macros in asts:
+            return macros, list(asts)
+        return [], []
+
+    def _reparse(self, source):
+        removed = len(self.elements)
+
+        self.source = source
+        self.valid = False
+        self.macros, asts = self._parse(source)
+        formatter = Formatter(self.macros, self.provenance)
+        self.asts = []
+        self.elements = []
+        self._components = [] # Where each of _defined is defined.
+        self._defined = []
+        for ast in asts:
+            if ast.tag == 'component':
+                self._components.append(ast.span[0])
+                self._defined.append(formatter.define(ast))
+            else:
+                self.asts.append(ast)
+                self.elements.append(formatter.el(ast))
+        self.valid = True
+
+        self._begins = [ast.span[0] for ast in self.asts]
+        self._ends = [ast.span[1] for ast in self.asts]
+        self._macrosEnd = self.macros and self.macros[-1].span[1] or 0
+
+        return 0, removed, len(self.asts)
+
+
+#########################################################################
+## Compiled spec cache.
+#########################################################################
+
+
+# Bump whenever what a spec compiles to changes, so that SpecCache (and
+# loadBuilder()) don't reuse what an older pygoo made of it.
+_COMPILED_REVISION = 2
+
+
+def _specKey(source, salt=''):
+    # Identifies what this version of pygoo makes of source.
+    key = sha1('%s\0%d\0%s\0' % (__version__, _COMPILED_REVISION, salt))
+    key.update(source)
+    return key.hexdigest()
+
+
+class SpecCache:
     '''
-    Merge attributes in subelements into an options dictionary.
+    An on-disk cache of compiled specs, for programs that compile the
+    same spec strings every time they start.
+
+    Entries are keyed by a hash of the spec source and the pygoo version
+    and hold the element trees in the binary format of compile() (with
+    their span attributes if spans is true) so loading one costs a
+    fraction of parsing the spec.
+    When the entries add up to more than maxsize bytes the least recently
+    used ones are removed.  hits and misses count the lookups.  The
+    directory (CACHE_DIR/specs by default) is made private to you and
+    not used at all if it's someone else's or others can write to it.
     '''
-    for subelement in iterable:
-        options[subelement.tag] = subelement.text
+
+    def __init__(self, directory=None, maxsize=2**24, spans=False):
+        if directory is None:
+            directory = os.path.join(CACHE_DIR, 'specs')
+        self.directory = directory
+        self.maxsize = maxsize
+        self.spans = spans
+        self.hits = self.misses = 0
+
+    def toXML(self, source, engine='earley'):
+        '''
+        Like toXML(source, engine) but served from the cache if possible.
+        Each call returns new Element objects.
+        '''
+        key = _specKey(source, bool(self.spans))
+        path = os.path.join(self.directory, 'spec-%s.bin' % key)
+
+        elements = self._load(path)
+        if elements is not None:
+            self.hits += 1
+            return elements
+
+        self.misses += 1
+        provenance = self.spans and 'span' or 'none'
+        elements = toXML(source, engine, provenance)
+        self._save(path, _encode(elements, self.spans))
+        return elements
+
+    def clear(self):
+        '''
+        Remove all the cached specs.
+        '''
+        for path, size, mtime in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _entries(self):
+        try:
+            names = fnmatch.filter(os.listdir(self.directory), 'spec-*.bin')
+        except OSError:
+            return []
+        entries = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue # Removed under our feet.
+            entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    def _load(self, path):
+        if not _cacheDir(self.directory):
+            return None
+        try:
+            f = open(path, 'rb')
+            try:
+                elements = load(f.read())
+            finally:
+                f.close()
+            os.utime(path, None) # The mtime is the LRU clock.
+        except Exception:
+            return None
+        return elements
+
+    def _save(self, path, data):
+        if not _cacheDir(self.directory):
+            return
+        try:
+            fd, temp = tempfile.mkstemp(dir=self.directory)
+            f = os.fdopen(fd, 'wb')
+            try:
+                f.write(data)
+            finally:
+                f.close()
+            os.rename(temp, path)
+        except (IOError, OSError):
+            return # The cache is only an optimization.
+        self._evict()
+
+    def _evict(self):
+        entries = self._entries()
+        total = sum(size for path, size, mtime in entries)
+        if total <= self.maxsize:
+            return
+        entries.sort(key=lambda entry: entry[2])
+        for path, size, mtime in entries:
+            if total <= self.maxsize:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+#########################################################################
+## Binary compiled specs.
+#########################################################################
+
+
+# A compiled spec is the header, the string lengths, the shape stream and
+# the reference stream (arrays of uint32s) and then the strings
+# themselves, so the arrays are aligned and the whole thing can be used
+# straight from an mmap.  All numbers are little-endian.
+#
+# Both streams have a record for each element, in preorder.  The shape
+# record is the number of attributes, the (begin, end) offsets of the
+# element's source text if the spec has spans (_NOSPAN twice if the
+# element has none) and the number of its subelements.  The reference
+# record is the tag, then a key and a value for each attribute, all as
+# indices into the string table.
+_MAGIC = 'PGOO'
+_FORMAT = 1
+_HEADER = struct.Struct('<4sHHIII') # magic, format, flags and lengths
+_SPANS = 1
+_NOSPAN = 0xffffffff
+
+
+def compile(source, engine='earley', spans=False):
+    '''
+    Compile the spec in source to a string of bytes that load() turns
+    back into the elements toXML() would return, optionally with their
+    span attributes, many times faster than parsing the spec again.
+    '''
+    provenance = spans and 'span' or 'none'
+    return _encode(toXML(source, engine, provenance), spans)
+
+
+def _encode(elements, spans=False):
+    index = {}
+    number = index.setdefault
+    shape = []
+    refs = []
+
+    stack = list(reversed(elements))
+    while stack:
+        e = stack.pop()
+        attrib = e.attrib
+        shape.append(len(attrib))
+        if spans:
+            shape.extend(getattr(e, 'span', None) or (_NOSPAN, _NOSPAN))
+        shape.append(len(e))
+        refs.append(number(e.tag, len(index)))
+        for key, value in attrib.iteritems():
+            refs.append(number(key, len(index)))
+            refs.append(number(value, len(index)))
+        stack.extend(reversed(e))
+
+    strings = [None] * len(index)
+    for string, n in index.iteritems():
+        if isinstance(string, unicode):
+            string = string.encode('utf-8')
+        strings[n] = string
+
+    arrays = [array.array('I', a) for a in (map(len, strings), shape, refs)]
+    if sys.byteorder == 'big':
+        for a in arrays:
+            a.byteswap()
+
+    header = _HEADER.pack(
+        _MAGIC, _FORMAT, spans and _SPANS or 0,
+        len(strings), len(shape), len(refs))
+    return ''.join([header] + [a.tostring() for a in arrays] + strings)
+
+
+def load(data):
+    '''
+    Return the list of elements compiled into data by compile().  data
+    can be a string or anything else that slices like one, e.g. an mmap
+    of a compiled spec file (see mapFile()) shared by many processes.
+    '''
+    try:
+        header = _HEADER.unpack_from(data)
+    except struct.error:
+        header = None, None
+    if header[:2] != (_MAGIC, _FORMAT):
+        raise ValueError('Not a compiled pygoo spec')
+
+    pos = _HEADER.size
+    arrays = []
+    for n in header[3:]:
+        a = array.array('I')
+        a.fromstring(data[pos:pos + 4 * n])
+        if sys.byteorder == 'big':
+            a.byteswap()
+        arrays.append(a)
+        pos += 4 * n
+    lengths, shape, refs = arrays
+
+    blob = data[pos:]
+    strings = []
+    pos = 0
+    for n in lengths:
+        strings.append(intern(blob[pos:pos + n]))
+        pos += n
+
+    # The references come out of one iterator: a tag, then as many
+    # (key, value) pairs as the shape says.
+    refs = iter(map(strings.__getitem__, refs))
+    pairs = izip(refs, refs)
+    shape = iter(shape.tolist())
+    spans = header[2] & _SPANS
+
+    elements = []
+    stack = [] # [element, number of children still to come]
+    for n in shape:
+        e = E(next(refs), dict(islice(pairs, n)))
+
+        if stack:
+            top = stack[-1]
+            top[0].append(e)
+            top[1] -= 1
+            if not top[1]:
+                stack.pop()
+        else:
+            elements.append(e)
+
+        if spans:
+            begin, end = next(shape), next(shape)
+            if begin != _NOSPAN:
+                e.span = int(begin), int(end)
+        n = next(shape)
+        if n:
+            stack.append([e, n])
+
+    return elements
+
+
+#########################################################################
+## Realization backends.
+#########################################################################
+
+
+class TkBackend:
+    '''
+    The widget operations realize() needs, done with Tkinter.  A backend
+    provides:
+
+    create(master, tag, options) - make and return a widget for an
+        element with tag, inside master.
+    configure(widget, options) - change the widget's options.
+    bind(widget, event_specifier, callback, add=False) - bind an event,
+        in addition to the callbacks already bound to it if add is true.
+    grid(widget, options) - place the widget with the grid manager.
+
+    and, for WidgetPool and patch():
+
+    reset(widget, names) - set the named options back to their defaults.
+    unbind(widget, event_specifier) - remove an event's bindings.
+    forget(widget) - take the widget out of the grid.
+    destroy(widget) - destroy the widget and everything inside it.
+
+    and, for realizeIncremental():
+
+    schedule(widget, callback) - call callback from the event loop, the
+        next time it's idle.
+    '''
+
+    def create(self, master, tag, options):
+        return self.factory(tag)(master, **options)
+
+    def factory(self, tag):
+        '''
+        Return the Tkinter class create() uses for tag.  (A Plan looks
+        the classes up once instead of calling create(), unless create()
+        is overridden.)
+        '''
+        if tag.lower() == "frame":
+            return Tkinter.Frame
+        return getattr(Tkinter, tag.capitalize())
+
+    def configure(self, widget, options):
+        widget.configure(**options)
+
+    def bind(self, widget, event_specifier, callback, add=False):
+        widget.bind(event_specifier, callback, add and '+' or '')
+
+    def grid(self, widget, options):
+        widget.grid(**options)
+
+    def reset(self, widget, names):
+        defaults = {}
+        for name in names:
+            description = widget.configure(name)
+            if len(description) == 2:
+                # An alias, like bg for background.
+                description = widget.configure(description[1])
+            defaults[name] = description[3]
+        widget.configure(defaults)
+
+    def unbind(self, widget, event_specifier):
+        widget.unbind(event_specifier)
+
+    def forget(self, widget):
+        widget.grid_forget()
+
+    def destroy(self, widget):
+        widget.destroy()
+
+    def schedule(self, widget, callback):
+        widget.after_idle(callback)
+
+
+class RecordedWidget:
+    '''
+    A widget made by a RecordingBackend: just its path, tag, parent,
+    children (by name) and current options.
+    '''
+
+    def __init__(self, master, tag, name, options):
+        self.master = master
+        self.tag = tag
+        self.options = options
+        self.children = {}
+        if master is None:
+            self.path = name
+        else:
+            self.path = '%s.%s' % (master.path.rstrip('.'), name)
+            master.children[name] = self
+
+    def __repr__(self):
+        return '<%s %s>' % (self.tag, self.path)
+
+
+class RecordingBackend:
+    '''
+    A headless backend that records every operation instead of making
+    widgets, so realization can be tested and timed without a display.
+
+    log is the list of (operation, widget path, arguments...) entries,
+    the same for the same elements every time: widgets without a name
+    option are named after their tag and a counter, options are sorted
+    and callbacks appear by name.  times holds the clock() value at the
+    time of each entry.  Realize into the root widget.
+    '''
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.root = RecordedWidget(None, 'root', '.', {})
+        self.log = []
+        self.times = []
+        self.count = 0
+        self.pending = [] # scheduled callbacks, see update()
+
+    def create(self, master, tag, options):
+        options = dict(options)
+        name = options.pop('name', None)
+        if not name:
+            self.count += 1
+            name = '%s%d' % (tag.lower(), self.count)
+        widget = RecordedWidget(master, tag, name, options)
+        self._record('create', widget, tag, options)
+        return widget
+
+    def configure(self, widget, options):
+        widget.options.update(options)
+        self._record('configure', widget, options)
+
+    def bind(self, widget, event_specifier, callback, add=False):
+        callback = getattr(callback, '__name__', callback)
+        self._record('bind', widget, event_specifier, callback)
+
+    def grid(self, widget, options):
+        self._record('grid', widget, options)
+
+    def reset(self, widget, names):
+        for name in names:
+            widget.options.pop(name, None)
+        self._record('reset', widget, sorted(names))
+
+    def unbind(self, widget, event_specifier):
+        self._record('unbind', widget, event_specifier)
+
+    def forget(self, widget):
+        self._record('forget', widget)
+
+    def destroy(self, widget):
+        name = widget.path.rsplit('.', 1)[1]
+        if widget.master.children.get(name) is widget:
+            del widget.master.children[name]
+        self._record('destroy', widget)
+
+    def schedule(self, widget, callback):
+        self.pending.append(callback)
+        self._record('schedule', widget)
+
+    def update(self):
+        '''
+        Call the scheduled callbacks, and those they schedule, until there
+        are none left, as the event loop would.  Returns how many ran.
+        '''
+        count = 0
+        while self.pending:
+            count += 1
+            self.pending.pop(0)()
+        return count
+
+    def _record(self, operation, widget, *args):
+        entry = [operation, widget.path]
+        for arg in args:
+            if isinstance(arg, dict):
+                arg = sorted(arg.iteritems())
+            entry.append(arg)
+        self.log.append(tuple(entry))
+        self.times.append(self.clock())
+
+    def dump(self, file=sys.stdout):
+        '''
+        Print the log, one operation per line.
+        '''
+        for entry in self.log:
+            print >> file, ' '.join(map(str, entry))
+
+    def rate(self):
+        '''
+        Return the number of operations per second between the first
+        and the last one recorded.
+        '''
+        if len(self.times) < 2 or self.times[-1] == self.times[0]:
+            return 0.0
+        return (len(self.times) - 1) / (self.times[-1] - self.times[0])
+
+
+# The backend realize() uses unless it's given another.
+TK = TkBackend()
+
+
+class WidgetPool:
+    '''
+    A backend that recycles widgets.  Pass it to realize() and release()
+    the widgets you'd otherwise destroy; the next realize() takes the
+    widgets it needs from the pool, if it has them, and reconfigures,
+    rebinds and regrids them instead of making new ones.
+
+    Widgets are pooled by parent and tag (and name, because a Tk widget's
+    name can't change) so a released dialog is rebuilt out of its own
+    widgets.  Options a reused widget had but the new element doesn't are
+    reset to their defaults.  At most limit widgets are kept, released
+    widgets that don't fit are destroyed.  hits and misses count the
+    widgets reused and made, see also hitRate().
+
+    backend - what really makes the widgets, TK by default.
+    '''
+
+    def __init__(self, backend=None, limit=1000):
+        if backend is None:
+            backend = TK
+        self.backend = backend
+        self.limit = limit
+        self.size = 0
+        self.hits = self.misses = 0
+        self._free = {} # parent -> {(tag, name): [widget...]}
+        # widget -> [parent, (tag, name), options, events bound, children]
+        self._info = weakref.WeakKeyDictionary()
+
+    def hitRate(self):
+        '''
+        Return the fraction of the widgets asked for that were reused.
+        '''
+        total = self.hits + self.misses
+        return total and float(self.hits) / total or 0.0
+
+    def create(self, master, tag, options):
+        options = dict(options)
+        kind = tag.lower(), options.pop('name', None)
+        free = self._free.get(master, {}).get(kind)
+
+        if free:
+            widget = free.pop()
+            self.size -= 1
+            self.hits += 1
+            info = self._info[widget]
+            old = info[2]
+            stale = [name for name in old if name not in options]
+            if stale:
+                self.backend.reset(widget, stale)
+            changed = dict(
+                item for item in options.iteritems()
+                if old.get(item[0], self) != item[1])
+            if changed:
+                self.backend.configure(widget, changed)
+            info[2] = options
+
+        else:
+            self.misses += 1
+            if kind[1]:
+                self._evict(master, kind[1])
+                options['name'] = kind[1]
+            widget = self.backend.create(master, tag, options)
+            options.pop('name', None)
+            self._info[widget] = [master, kind, options, [], []]
+
+        parent = self._info.get(master)
+        if parent is not None:
+            parent[4].append(widget)
+        return widget
+
+    def configure(self, widget, options):
+        info = self._info.get(widget)
+        if info is not None:
+            info[2].update(options)
+        self.backend.configure(widget, options)
+
+    def bind(self, widget, event_specifier, callback, add=False):
+        info = self._info.get(widget)
+        if info is not None:
+            info[3].append(event_specifier)
+        self.backend.bind(widget, event_specifier, callback, add)
+
+    def grid(self, widget, options):
+        self.backend.grid(widget, options)
+
+    def reset(self, widget, names):
+        info = self._info.get(widget)
+        if info is not None:
+            for name in names:
+                info[2].pop(name, None)
+        self.backend.reset(widget, names)
+
+    def unbind(self, widget, event_specifier):
+        info = self._info.get(widget)
+        if info is not None and event_specifier in info[3]:
+            info[3].remove(event_specifier)
+        self.backend.unbind(widget, event_specifier)
+
+    def forget(self, widget):
+        self.backend.forget(widget)
+
+    def schedule(self, widget, callback):
+        self.backend.schedule(widget, callback)
+
+    def destroy(self, widget):
+        # Asked to destroy a widget (by patch(), say) the pool keeps it.
+        self.release(widget)
+
+    def release(self, widget):
+        '''
+        Give back a widget made through the pool, and everything made
+        inside it, instead of destroying it.
+        '''
+        backend = self.backend
+        info = self._info.get(widget)
+        parent = info and self._info.get(info[0])
+        if parent and widget in parent[4]:
+            parent[4].remove(widget)
+        stack = [widget]
+        while stack:
+            widget = stack.pop()
+            info = self._info.get(widget)
+            if info is None:
+                backend.destroy(widget) # Not ours to recycle.
+                continue
+
+            if self.size >= self.limit:
+                backend.destroy(widget)
+                self._drop(widget)
+                continue
+
+            backend.forget(widget)
+            for event_specifier in info[3]:
+                backend.unbind(widget, event_specifier)
+            info[3] = []
+            children, info[4] = info[4], []
+            free = self._free.setdefault(info[0], {})
+            free.setdefault(info[1], []).append(widget)
+            self.size += 1
+            # Pooled last to first, so they're reused first to last and a
+            # rebuilt dialog gets each widget back in its old place.
+            stack.extend(children)
+
+    def clear(self):
+        '''
+        Destroy all the pooled widgets.
+        '''
+        for parent in self._free.keys():
+            if parent not in self._free:
+                continue # Went with its own parent.
+            for free in self._free[parent].values():
+                for widget in list(free):
+                    self.backend.destroy(widget)
+                    self._drop(widget)
+            self._free.pop(parent, None)
+
+    def _evict(self, master, name):
+        # Tk destroys a widget when another one is made with its name in
+        # the same parent, so forget any we have, in use or pooled.
+        parent = self._info.get(master)
+        if parent is not None:
+            for widget in parent[4]:
+                if self._info[widget][1][1] == name:
+                    parent[4].remove(widget)
+                    self._drop(widget)
+                    break
+        for kind, free in self._free.get(master, {}).items():
+            if kind[1] == name:
+                for widget in list(free):
+                    self._drop(widget)
+
+    def _drop(self, widget):
+        # Forget a destroyed widget and everything inside it, including
+        # any pooled widgets that were waiting for it to be reused.
+        stack = [widget]
+        while stack:
+            widget = stack.pop()
+            info = self._info.pop(widget, None)
+            if info is not None:
+                stack.extend(info[4])
+            for free in self._free.pop(widget, {}).itervalues():
+                self.size -= len(free)
+                stack.extend(free)
+            if info is not None and info[0] in self._free:
+                free = self._free[info[0]].get(info[1], ())
+                if widget in free:
+                    free.remove(widget)
+                    self.size -= 1
+
+
+#########################################################################
+## Convert ElementTree elements into Tkinter widgets.
+#########################################################################
+
+
+def realize(master, element, namespace=None, backend=None):
+    '''
+    Grok XML description into actual widgets.
+
+    master - Tkinter container widget to use as this widget's parent.
+    element - ElementTree Element describing the desired widget.
+    namespace - [Optional] a namespace to bind child widgets to, if their
+        'name' attribute is specified in the element XML.  (Hint: pass a
+        class's __dict__ object to have widgets available as attributes
+        of their instance.  See the example below.)
+    backend - [Optional] what makes the widgets, TK (a TkBackend) by
+        default.  See RecordingBackend for one that needs no display.
+
+    A frame with a true lazy attribute (lazy = 1) is made empty and its
+    subelements are only realized when it's first mapped, when expand()
+    is called on it, or when a named widget inside it is used through
+    the stand-in put in the namespace for it.
+
+    A virtuallist element is a frame showing a row for each item of a
+    sequence, see VirtualList, which is what goes in the namespace.
+    '''
+
+    if namespace is None:
+        namespace = {}
+    if backend is None:
+        backend = TK
+
+    bindings, options = _getBindingsAndOptions(element.attrib, namespace)
+    lazy = options.pop('lazy', '0').lower() not in _FALSE
+    name = element.get('name')
+    grid = None
+
+    if element.tag.lower() == "frame":
+
+        widget = backend.create(master, element.tag, options)
+        subelements = []
+
+        for subelement in element:
+
+            if subelement.tag.lower() == "grid":
+                grid = subelement
+                continue
+
+            if lazy:
+                subelements.append(subelement)
+            else:
+                realize(widget, subelement, namespace, backend)
+
+        if lazy:
+            lazy = _Lazy(widget, subelements, namespace, backend)
+
+    elif element.tag.lower() == "virtuallist":
+        lazy = None
+        template = []
+        for subelement in element:
+            if subelement.tag.lower() == "grid":
+                grid = subelement
+            else:
+                template.append(subelement)
+
+        settings = dict(rows='10', buffer='2')
+        for key in ('source', 'rows', 'buffer', 'scrollbar'):
+            if key in options:
+                settings[key] = options.pop(key)
+
+        widget = backend.create(master, "frame", options)
+        # A backend can have the rows, which come and go as the list
+        # scrolls, made by another one.
+        virtual = VirtualList(
+            widget, template, namespace.get(settings.get('source'), ()),
+            int(settings['rows']), int(settings['buffer']), namespace,
+            getattr(backend, 'rowBackend', backend))
+
+        scrollbar = namespace.get(settings.get('scrollbar'))
+        if scrollbar is not None:
+            backend.configure(scrollbar, {'command': virtual.yview})
+            virtual.yscrollcommand = getattr(scrollbar, 'set', None)
+            if virtual.yscrollcommand is not None:
+                virtual.yscrollcommand(*virtual.yview())
+
+        if name: namespace[name] = virtual
+        name = None
+
+    else:
+        lazy = None # Only frames have subelements to put off.
+
+        if element:
+
+            D = dict((n.tag.lower(), n) for n in element)
+
+            grid = D.pop('grid', None)
+
+            _merge_subelements_to_options(D.values(), options)
+
+        widget = backend.create(master, element.tag, options)
+
+    if name: namespace[name] = widget
+
+    for event_specifier, callback in bindings.iteritems():
+        backend.bind(widget, event_specifier, callback)
+
+    if lazy:
+        backend.bind(widget, '<Map>', lazy.mapped, True)
+
+    _grid(widget, grid, backend)
+
+    return widget
+
+
+# Values of the lazy attribute that mean no.
+_FALSE = set(['', '0', 'false', 'no', 'off'])
+
+# Lazy frame widgets whose subelements are still to be realized.
+_lazy = weakref.WeakKeyDictionary()
+
+
+def expand(widget):
+    '''
+    Realize the subelements of a lazy frame widget now, if that hasn't
+    been done yet.  See realize().
+    '''
+    lazy = _lazy.get(widget)
+    if lazy is not None:
+        lazy.expand()
+
+
+class _Lazy:
+    # The deferred subelements of a lazy frame widget.
+
+    def __init__(self, widget, subelements, namespace, backend):
+        self.widget = weakref.ref(widget)
+        self.subelements = subelements
+        self.namespace = namespace
+        self.backend = backend
+        _lazy[widget] = self
+        for subelement in subelements:
+            for e in subelement.iter():
+                name = e.get('name')
+                if name:
+                    namespace[name] = _LazyWidget(self, name)
+
+    def mapped(self, event=None):
+        self.expand()
+
+    def expand(self):
+        subelements, self.subelements = self.subelements, None
+        widget = self.widget()
+        if subelements is None or widget is None:
+            return
+        del _lazy[widget]
+        for subelement in subelements:
+            realize(widget, subelement, self.namespace, self.backend)
+
+
+class _LazyWidget:
+    '''
+    Stands in the namespace for a named widget in a lazy frame until the
+    frame is expanded.  Any use of it (an attribute, str(), w['text']...)
+    expands the frame and is passed on to the real widget, which has
+    replaced it in the namespace by then.
+    '''
+    # A classic class, so even special methods go through __getattr__.
+
+    def __init__(self, lazy, name):
+        self._lazy = lazy
+        self._name = name
+
+    def __getattr__(self, attr):
+        self._lazy.expand()
+        widget = self._lazy.namespace.get(self._name, self)
+        if widget is self:
+            raise AttributeError(attr)
+        return getattr(widget, attr)
+
+
+class VirtualList:
+    '''
+    The rows of a virtuallist element, which shows the items of a
+    sequence (the source, anything with len() and indexing, say a list
+    of dicts) one row per item, using the element's subelements as the
+    template of a row.  Only the rows that are showing, and buffer more
+    that were shown last, are realized, each in a frame of its own, and
+    scrolling fills them with other items instead of making new ones,
+    so a list of a million items costs as much as a list of a screenful.
+
+        scrollbar name = bar .
+        virtuallist
+            source = records
+            rows = 20
+            buffer = 4
+            scrollbar = bar
+            label text = "%(name)s" .
+            label text = "%(size)d bytes" column = 1 .
+        .
+
+    Options of the template with a %(key)s format in them are formatted
+    for each item: the keys are looked up in the item, by key or as an
+    index if they're numbers, then index and item are the item's
+    position and the item itself, and any other keys are looked up as
+    attributes of the item (so a tuple's index() method doesn't hide
+    its position.)  The callbacks of a row's bindings are looked up in a
+    copy of the namespace, which also gets the row's named widgets, and
+    index(widget) tells which item a widget is showing.
+
+    rows is how many rows to show (10 by default), buffer how many more
+    to keep (2), scrollbar the name of a scrollbar made before it in the
+    spec, which is hooked up to yview() and yscrollcommand.
+
+    widget - the frame the rows are gridded in.
+    source - the sequence of items, call refresh() after changing it.
+    first - the index of the first item showing.
+    yscrollcommand - None or a function to call with the first and last
+        fractions showing whenever they change, e.g. a Scrollbar's set().
+    '''
+
+    def __init__(self, widget, template, source, rows, buffer, namespace,
+                 backend=None):
+        if backend is None:
+            backend = TK
+        self.widget = widget
+        self.source = source
+        self.rows = rows
+        self.namespace = namespace
+        self.backend = backend
+        self.first = 0
+        self.yscrollcommand = None
+        self._count = rows + buffer
+        self._plan = plan(template)
+        # The options to format: [(slot, op index, {option: format})...]
+        self._formats = []
+        slot = 0
+        for n, op in enumerate(self._plan.ops):
+            if op[0] in ('create', 'realize'):
+                slot += 1
+            if op[0] == 'create':
+                formats = dict(
+                    item for item in op[3].iteritems()
+                    if '%(' in item[1])
+                if formats:
+                    self._formats.append((slot, n, formats))
+        # Item index modulo _count -> [frame, slots, index of the item
+        # shown, grid row or None, formatted options for each format]
+        self._rows = {}
+        self._show()
+
+    def refresh(self):
+        '''
+        Fill the rows again from the source, after it changed.
+        '''
+        for row in self._rows.itervalues():
+            row[2] = None
+        self._show()
+
+    def scrollTo(self, index):
+        '''
+        Show the items from index on (or as near as there are.)
+        '''
+        self.first = index
+        self._show()
+
+    def yview(self, *args):
+        '''
+        Scroll as a Scrollbar's command asks, ('moveto', fraction) or
+        ('scroll', n, 'units' or 'pages'), or, given nothing, return the
+        first and last fractions of the items showing.
+        '''
+        n = len(self.source)
+        if not args:
+            if not n:
+                return 0.0, 1.0
+            return (float(self.first) / n,
+                    float(min(self.first + self.rows, n)) / n)
+        if args[0] == 'moveto':
+            self.scrollTo(int(round(float(args[1]) * n)))
+        elif args[0] == 'scroll':
+            count = int(args[1])
+            if args[2].startswith('page'):
+                count *= self.rows
+            self.scrollTo(self.first + count)
+
+    def index(self, widget):
+        '''
+        Return the index of the item shown by the row widget is in, or
+        None if it isn't in a row that's showing.
+        '''
+        frames = dict((id(row[0]), row) for row in self._rows.itervalues())
+        while widget is not None:
+            row = frames.get(id(widget))
+            if row is not None:
+                if row[3] is not None:
+                    return row[2]
+                return None
+            widget = getattr(widget, 'master', None)
+
+    def _show(self):
+        n = len(self.source)
+        self.first = first = max(0, min(self.first, n - self.rows))
+        backend = self.backend
+        showing = set()
+
+        for i in xrange(first, min(first + self.rows, n)):
+            number = i % self._count
+            showing.add(number)
+            row = self._rows.get(number)
+            if row is None:
+                row = self._rows[number] = self._row(i)
+            elif row[2] != i:
+                self._fill(row, i)
+            if row[3] != i - first:
+                row[3] = i - first
+                backend.grid(row[0], {'row': row[3], 'sticky': 'ew'})
+
+        for number, row in self._rows.iteritems():
+            if number not in showing and row[3] is not None:
+                row[3] = None
+                backend.forget(row[0])
+
+        if self.yscrollcommand is not None:
+            self.yscrollcommand(*self.yview())
+
+    def _row(self, i):
+        # Make a row showing item i, with its options formatted already.
+        fields = _Fields(self.source[i], i)
+        ops = list(self._plan.ops)
+        shown = []
+        for slot, n, formats in self._formats:
+            options = dict(ops[n][3])
+            for option, format in formats.iteritems():
+                options[option] = format % fields
+            ops[n] = ops[n][:3] + (options,)
+            shown.append(options)
+        frame = self.backend.create(self.widget, 'frame', {})
+        top, slots = Plan(ops)._instantiate(
+            frame, dict(self.namespace), self.backend)
+        return [frame, slots, i, None, shown]
+
+    def _fill(self, row, i):
+        row[2] = i
+        fields = _Fields(self.source[i], i)
+        for (slot, n, formats), shown in izip(self._formats, row[4]):
+            changed = {}
+            for option, format in formats.iteritems():
+                value = format % fields
+                if shown.get(option) != value:
+                    changed[option] = shown[option] = value
+            if changed:
+                self.backend.configure(row[1][slot], changed)
+
+
+class _Fields:
+    # An item of a VirtualList's source, as a mapping for % formatting.
+
+    def __init__(self, item, index):
+        self.item = item
+        self.index = index
+
+    def __getitem__(self, key):
+        item = self.item
+        try:
+            return item[key]
+        except (KeyError, IndexError, TypeError, AttributeError):
+            pass
+        try:
+            return item[int(key)]
+        except (KeyError, IndexError, TypeError, AttributeError, ValueError):
+            pass
+        if key == 'index':
+            return self.index
+        if key == 'item':
+            return item
+        try:
+            return getattr(item, key)
+        except AttributeError:
+            raise KeyError(key)
+
+
+def _getBindingsAndOptions(options, namespace):
+    bindings, settings = {}, {}
+    for key, value in options.iteritems():
+        if key.startswith('<') and key.endswith('>'):
+            try:
+                bindings[key] = namespace[value]
+            except KeyError:
+##                print 'bad binding: %s := %s' % (key, value)
+                continue
+        else:
+            settings[key] = value
+    return bindings, settings
+
+
+def _grid(widget, element, backend=TK):
+    '''
+    Collect grid options from element and use them to place the widget
+    using the 'grid' layout manager.
+    '''
+
+    if element is None:
+        options = {}
+
+    else:
+        options = element.attrib.copy()
+        _merge_subelements_to_options(element, options)
+
+    backend.grid(widget, options)
+
+
+def _merge_subelements_to_options(iterable, options):
+    '''
+    Merge attributes in subelements into an options dictionary.
+    '''
+    for subelement in iterable:
+        options[subelement.tag] = subelement.text
+
+
+# The Tcl commands that make the widgets of the Tkinter classes whose
+# constructors do nothing else, so realizeBatched() can script them.
+_TCL_COMMANDS = {}
+for _name in '''
+    Button Canvas Checkbutton Entry Frame Label LabelFrame Listbox
+    Message PanedWindow Radiobutton Scale Scrollbar Spinbox Text
+    '''.split():
+    if hasattr(Tkinter, _name):
+        _TCL_COMMANDS[getattr(Tkinter, _name)] = _name.lower()
+del _name
+
+# Characters with a meaning in a Tcl word, and their escapes.
+_TCL_SPECIAL = re.compile(r'[\\\[\]{}$;"\s]')
+_TCL_ESCAPES = {'\n': '\\n', '\r': '\\r', '\t': '\\t'}
+
+
+def _tclCommand(words):
+    # A line of Tcl script that calls the command with the words as
+    # arguments, exactly, whatever characters are in them.
+    return ' '.join(map(_tclWord, words))
+
+
+def _tclWord(word):
+    if not isinstance(word, basestring):
+        word = str(word)
+    if not word:
+        return '{}'
+    return _TCL_SPECIAL.sub(_tclEscape, word)
+
+
+def _tclEscape(m):
+    c = m.group()
+    return _TCL_ESCAPES.get(c) or '\\' + c
+
+
+def realizeBatched(master, elements, namespace=None):
+    '''
+    Like calling realize(master, element, namespace) for each of the
+    elements, but the widgets are created, bound and gridded by one Tcl
+    script evaluated in a single call instead of a round trip to Tcl for
+    every constructor, bind() and grid().  Returns the list of top-level
+    widgets.
+
+    The Tkinter widget objects are still made, without calling their
+    constructors, so the namespace gets the named widgets as usual.  Each
+    callback is registered with Tcl once for each element, however many
+    of its widgets it's bound to, on the element's top-level widget, so
+    it goes when that's destroyed, as with realize().
+    Widgets of classes that aren't in _TCL_COMMANDS are made, with their
+    subelements, by realize() in the middle of the batch.
+    '''
+    if namespace is None:
+        namespace = {}
+
+    script = []
+    line = script.append
+    top = []
+
+    for element in elements:
+        commands = {} # callback -> Tcl script that calls it
+        owner = None # The element's widget, which the callbacks go with.
+        stack = [(element, master, None, None, None)]
+        while stack:
+            e, parent, widget, bindings, settings = stack.pop()
+
+            if widget is not None:
+                name = e.get('name')
+                if name: namespace[name] = widget
+
+                for event_specifier, callback in bindings.iteritems():
+                    command = commands.get(callback)
+                    if command is None:
+                        if isinstance(callback, basestring):
+                            command = callback
+                        else:
+                            command = 'if {"[%s %s]" == "break"} break\n' % (
+                                owner._register(callback, owner._substitute),
+                                owner._subst_format_str,
+                                )
+                        commands[callback] = command
+                    line(_tclCommand(
+                        ('bind', widget._w, event_specifier, command)))
+
+                line(_tclCommand(('grid', 'configure', widget._w) +
+                                 widget._options(settings)))
+                continue
+
+            if e.tag.lower() == "frame":
+                factory = Tkinter.Frame
+            else:
+                factory = getattr(Tkinter, e.tag.capitalize(), None)
+
+            command = _TCL_COMMANDS.get(factory)
+            if command is None or _isLazy(e):
+                if script:
+                    master.tk.eval('\n'.join(script))
+                    del script[:]
+                widget = realize(parent, e, namespace)
+                if parent is master:
+                    top.append(widget)
+                continue
+
+            bindings, options, settings, children = _parts(e)
+            bindings = _getBindingsAndOptions(bindings, namespace)[0]
+            if script and options.get('name') in parent.children:
+                # _setup() destroys the widget it replaces right away.
+                master.tk.eval('\n'.join(script))
+                del script[:]
+
+            widget = types.InstanceType(factory)
+            widget.widgetName = command
+            widget._setup(parent, options)
+            widget._tclCommands = []
+            line(_tclCommand((command, widget._w) + widget._options(options)))
+            if parent is master:
+                top.append(widget)
+                owner = widget
+
+            stack.append((e, parent, widget, bindings, settings))
+            stack.extend(
+                (child, widget, None, None, None)
+                for child in reversed(children))
+
+    if script:
+        master.tk.eval('\n'.join(script))
+    return top
+
+
+def realizeIncremental(master, elements, namespace=None, backend=None,
+                       budget=10, progress=None):
+    '''
+    Like calling realize(master, element, namespace, backend) for each of
+    the elements, but a few at a time, from the event loop, so it stays
+    responsive and what's made first is drawn while the rest is made.
+    Returns a Realization, which is done when all the widgets are made.
+
+    Each chunk makes widgets for budget milliseconds, calls progress, if
+    given, with the Realization, and schedules the next one with the
+    backend's schedule().  The first chunk is scheduled too, so nothing
+    is made before the event loop runs.  The elements are walked with a
+    stack of their own, not recursively, so frames can be nested any
+    depth, and they can be any iterable, iterXML(source) say, as they're
+    only taken from it as they're needed.  Lazy frames and virtuallists
+    are made by realize() in one go.
+
+    Unlike realize(), which grids a frame once everything inside it is
+    made, each widget is gridded as soon as it's made, so a frame shows
+    while it's being filled in.  Names and bindings still come last.
+    '''
+    if namespace is None:
+        namespace = {}
+    if backend is None:
+        backend = TK
+
+    elements = iter(elements)
+    realization = Realization()
+    # (parent, element) to start or (widget, element, bindings) to
+    # finish, with the parent a frame that's been made.
+    stack = []
+
+    def finish(widget, element, bindings):
+        name = element.get('name')
+        if name: namespace[name] = widget
+        for event_specifier, callback in bindings.iteritems():
+            backend.bind(widget, event_specifier, callback)
+
+    def start(parent, element):
+        tag = element.tag.lower()
+
+        if tag == "virtuallist" or _isLazy(element):
+            widget = realize(parent, element, namespace, backend)
+
+        else:
+            bindings, options, settings, children = _parts(element)
+            bindings = _getBindingsAndOptions(bindings, namespace)[0]
+            widget = backend.create(parent, element.tag, options)
+            backend.grid(widget, settings)
+            if tag == "frame":
+                stack.append((widget, element, bindings))
+                stack.extend(
+                    (widget, child) for child in reversed(children))
+            else:
+                finish(widget, element, bindings)
+
+        realization.count += 1
+        if parent is master:
+            realization.widgets.append(widget)
+
+    def chunk():
+        if realization.done:
+            return # Cancelled.
+        deadline = time.time() + budget / 1000.0
+        try:
+            while True:
+                if not stack:
+                    for element in elements:
+                        stack.append((master, element))
+                        break
+                    else:
+                        realization._finish()
+                        return
+                item = stack.pop()
+                if len(item) == 2:
+                    start(*item)
+                else:
+                    finish(*item)
+                if time.time() >= deadline:
+                    break
+        except Exception:
+            realization._finish(sys.exc_info())
+            return
+        if progress is not None:
+            progress(realization)
+        backend.schedule(master, chunk)
+
+    backend.schedule(master, chunk)
+    return realization
+
+
+class Realization:
+    '''
+    A realizeIncremental() in progress, something like a future.
+
+    widgets - the top-level widgets made so far.
+    count - the number of widgets made so far.
+    done - whether it's over: finished, failed or cancelled.
+    cancelled - whether cancel() stopped it.
+    '''
+
+    def __init__(self):
+        self.widgets = []
+        self.count = 0
+        self.done = False
+        self.cancelled = False
+        self._exc_info = None
+        self._callbacks = []
+
+    def addDoneCallback(self, callback):
+        '''
+        Call callback with the Realization when it's done, or right away
+        if it is already.
+        '''
+        if self.done:
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    def cancel(self):
+        '''
+        Stop making widgets.  The ones already made are left as they are.
+        Returns False if it was done already.
+        '''
+        if self.done:
+            return False
+        self.cancelled = True
+        self._finish()
+        return True
+
+    def result(self):
+        '''
+        Return the top-level widgets, or raise what went wrong making
+        them.  Raises RuntimeError if it's not done yet.
+        '''
+        if not self.done:
+            raise RuntimeError('Not done yet')
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self.widgets
+
+    def _finish(self, exc_info=None):
+        self.done = True
+        self._exc_info = exc_info
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+#########################################################################
+## Update realized widgets in place.
+#########################################################################
+
+
+class Mount:
+    '''
+    The widgets mount() realized from a list of elements, kept in the
+    shape of the elements so patch() can find the widget for each one.
+
+    master, namespace, backend - as passed to mount().
+    widgets - the top-level widgets, one per element.
+    '''
+
+    def __init__(self, master, namespace, backend):
+        self.master = master
+        self.namespace = namespace
+        self.backend = backend
+        # One node per element: [widget, nodes of its children], the
+        # children being None for anything but a frame whose subelements
+        # were realized with it (i.e. not a lazy one.)
+        self.nodes = []
+
+    @property
+    def widgets(self):
+        return [node[0] for node in self.nodes]
+
+
+def mount(master, elements, namespace=None, backend=None):
+    '''
+    Realize the elements like realize() does, one after another, and
+    return a Mount to pass to patch() later.
+    '''
+    if namespace is None:
+        namespace = {}
+    if backend is None:
+        backend = TK
+    handle = Mount(master, namespace, backend)
+    handle.nodes = [
+        _realizeNode(master, element, namespace, backend)
+        for element in elements
+        ]
+    return handle
+
+
+def patch(old_elements, new_elements, handle):
+    '''
+    Update the widgets of a Mount, realized from old_elements, to what
+    new_elements describe, and return the handle.
+
+    Elements are matched up among their siblings by tag and name, or, if
+    they have no name, by tag and position among the unnamed ones.  For
+    each pair only the options, bindings and grid settings that differ
+    are changed: options that were dropped are reset to their defaults,
+    bindings that were dropped or changed are unbound first, and the
+    widget is taken out of the grid and gridded again only if a grid
+    setting was dropped.  Elements with no match are realized, widgets
+    with no match are destroyed.  The widget operations done are
+    proportional to what changed, not to the size of the whole tree, and
+    so is the comparing if new_elements shares the elements that didn't
+    change with old_elements (a subelement that's the same object in
+    both isn't looked into.)
+
+    A lazy frame or a virtuallist is replaced, as a whole, if anything in
+    it has changed.
+    '''
+    handle.nodes = _patchNodes(
+        handle.master, old_elements, new_elements, handle.nodes,
+        handle.namespace, handle.backend)
+    return handle
+
+
+class _Capture:
+    # A backend that keeps the widgets another one creates, in order,
+    # except for the rows of virtuallists, which it leaves to the other
+    # one.
+
+    def __init__(self, backend):
+        self.backend = self.rowBackend = backend
+        self.widgets = []
+
+    def create(self, master, tag, options):
+        widget = self.backend.create(master, tag, options)
+        if self.widgets is not None:
+            self.widgets.append(widget)
+        return widget
+
+    def __getattr__(self, attr):
+        return getattr(self.backend, attr)
+
+
+def _realizeNode(master, element, namespace, backend):
+    capture = _Capture(backend)
+    realize(master, element, namespace, capture)
+    widgets, capture.widgets = iter(capture.widgets), None # Lazy frames
+    return _node(element, widgets)                         # keep capture.
+
+
+def _node(element, widgets):
+    # realize() creates a widget for the element, then for each of its
+    # children in turn, depth first.
+    widget = widgets.next()
+    if element.tag.lower() != 'frame' or _isLazy(element):
+        return [widget, None]
+    return [widget, [
+        _node(subelement, widgets)
+        for subelement in element
+        if subelement.tag.lower() != 'grid'
+        ]]
+
+
+def _isLazy(element):
+    return (element.tag.lower() == 'frame' and
+            element.get('lazy', '0').lower() not in _FALSE)
+
+
+def _patchNodes(master, old_elements, new_elements, nodes, namespace,
+                backend):
+    old = {}
+    for key, element, node in izip(
+        _siblingKeys(old_elements), old_elements, nodes):
+        old[key] = element, node
+
+    matched = []
+    for key, element in izip(_siblingKeys(new_elements), new_elements):
+        matched.append((element, old.pop(key, None)))
+
+    for element, node in old.itervalues():
+        _destroyNode(element, node, namespace, backend)
+
+    result = []
+    for element, pair in matched:
+        if pair is None:
+            node = _realizeNode(master, element, namespace, backend)
+        else:
+            node = _patchNode(master, pair[0], element, pair[1],
+                              namespace, backend)
+        result.append(node)
+    return result
+
+
+def _siblingKeys(elements):
+    # What to match an element up with its old self by: its tag, name
+    # and how many siblings before it have both the same.
+    seen = {}
+    for element in elements:
+        key = element.tag.lower(), element.get('name') or None
+        n = seen[key] = seen.get(key, -1) + 1
+        yield key + (n,)
+
+
+def _patchNode(master, old, new, node, namespace, backend):
+    if old is new:
+        return node # Shared, so unchanged.
+    if _isLazy(old) or _isLazy(new) or old.tag.lower() == 'virtuallist':
+        if _same(old, new):
+            return node
+        _destroyNode(old, node, namespace, backend)
+        return _realizeNode(master, new, namespace, backend)
+
+    widget = node[0]
+    old_bindings, old_options, old_grid, old_children = _parts(old)
+    new_bindings, new_options, new_grid, new_children = _parts(new)
+    # It was matched up by name, which a widget can't change anyway.
+    old_options.pop('name', None)
+    new_options.pop('name', None)
+
+    dropped = [name for name in old_options if name not in new_options]
+    if dropped:
+        backend.reset(widget, dropped)
+    changed = _changed(old_options, new_options)
+    if changed:
+        backend.configure(widget, changed)
+
+    for event_specifier, callback in old_bindings.iteritems():
+        if new_bindings.get(event_specifier) != callback:
+            backend.unbind(widget, event_specifier)
+    bindings, options = _getBindingsAndOptions(
+        _changed(old_bindings, new_bindings), namespace)
+    for event_specifier, callback in bindings.iteritems():
+        backend.bind(widget, event_specifier, callback)
+
+    if [name for name in old_grid if name not in new_grid]:
+        backend.forget(widget)
+        backend.grid(widget, new_grid)
+    else:
+        changed = _changed(old_grid, new_grid)
+        if changed:
+            backend.grid(widget, changed)
+
+    if node[1] is not None:
+        node = [widget, _patchNodes(
+            widget, old_children, new_children, node[1], namespace, backend)]
+    return node
+
+
+def _parts(element):
+    # The bindings, options, grid settings and child elements realize()
+    # makes of a frame or a widget, as strings: the callbacks are still
+    # names to look up, and the lazy option is left out (see _isLazy().)
+    bindings, options = {}, {}
+    for key, value in element.attrib.iteritems():
+        if key.startswith('<') and key.endswith('>'):
+            bindings[key] = value
+        else:
+            options[key] = value
+    options.pop('lazy', None)
+
+    grid, children = None, []
+    if element.tag.lower() == 'frame':
+        for subelement in element:
+            if subelement.tag.lower() == 'grid':
+                grid = subelement
+            else:
+                children.append(subelement)
+    elif len(element):
+        D = dict((n.tag.lower(), n) for n in element)
+        grid = D.pop('grid', None)
+        _merge_subelements_to_options(D.values(), options)
+
+    settings = {}
+    if grid is not None:
+        settings = grid.attrib.copy()
+        _merge_subelements_to_options(grid, settings)
+    return bindings, options, settings, children
+
+
+def _changed(old, new):
+    return dict(
+        item for item in new.iteritems()
+        if old.get(item[0], _changed) != item[1])
+
+
+def _same(a, b):
+    # Whether two elements, and everything in them, are the same.
+    if (a.tag != b.tag or a.attrib != b.attrib or a.text != b.text or
+        len(a) != len(b)):
+        return False
+    for x, y in izip(a, b):
+        if not _same(x, y):
+            return False
+    return True
+
+
+def _destroyNode(element, node, namespace, backend):
+    # Take the names of the widget and those inside it out of the
+    # namespace, if they're still there, and destroy it.
+    stack = [(element, node)]
+    while stack:
+        e, n = stack.pop()
+        name = e.get('name')
+        value = namespace.get(name)
+        if name and n[0] in (value, getattr(value, 'widget', None)):
+            del namespace[name]
+        if n[1] is not None:
+            stack.extend(izip(
+                [s for s in e if s.tag.lower() != 'grid'], n[1]))
+        elif _isLazy(e):
+            for s in e.iter():
+                w = namespace.get(s.get('name'))
+                if isinstance(w, _LazyWidget) and (
+                    w._lazy.widget() is n[0]):
+                    del namespace[s.get('name')]
+    backend.destroy(node[0])
+
+
+#########################################################################
+## Realization plans.
+#########################################################################
+
+
+class Plan:
+    '''
+    What realize() would do for a list of elements, worked out once: which
+    widgets to make inside which, with what options, what to bind and how
+    to grid them.  instantiate() makes a new set of the widgets, so a
+    program that opens many copies of the same window decides all that
+    only once.  See plan() and PlanCache.
+
+    ops is the list of operations, tuples of:
+
+        ('create', parent, tag, options) - make a widget, the next slot.
+        ('name', slot, name) - put the widget in the namespace.
+        ('bind', slot, event_specifier, callback name)
+        ('grid', slot, options)
+        ('realize', parent, element) - realize() it, a lazy frame or a
+            virtuallist, into the next slot.
+
+    where slot 0 is the master and each widget made takes the next one.
+    '''
+
+    def __init__(self, ops):
+        self.ops = ops
+
+    def instantiate(self, master, namespace=None, backend=None):
+        '''
+        Make the widgets in master and return the top-level ones.  The
+        namespace and backend are as for realize(); the callbacks are
+        looked up in the namespace now, not when the plan was made.
+        '''
+        if namespace is None:
+            namespace = {}
+        if backend is None:
+            backend = TK
+        return self._instantiate(master, namespace, backend)[0]
+
+    def _instantiate(self, master, namespace, backend):
+        # The top-level widgets and the list of all the slots.
+        factory = None
+        create = getattr(backend.create, 'im_func', None)
+        if create is TkBackend.create.im_func:
+            factory = backend.factory
+        factories = {}
+        slots = [master]
+        top = []
+
+        for op in self.ops:
+            kind = op[0]
+
+            if kind == 'create':
+                parent, tag, options = slots[op[1]], op[2], op[3]
+                if factory is None:
+                    widget = backend.create(parent, tag, dict(options))
+                else:
+                    make = factories.get(tag)
+                    if make is None:
+                        make = factories[tag] = factory(tag)
+                    widget = make(parent, **options)
+                slots.append(widget)
+                if not op[1]:
+                    top.append(widget)
+
+            elif kind == 'name':
+                namespace[op[2]] = slots[op[1]]
+
+            elif kind == 'bind':
+                callback = namespace.get(op[3])
+                if callback is not None:
+                    backend.bind(slots[op[1]], op[2], callback)
+
+            elif kind == 'grid':
+                backend.grid(slots[op[1]], op[2])
+
+            else:
+                widget = realize(slots[op[1]], op[2], namespace, backend)
+                slots.append(widget)
+                if not op[1]:
+                    top.append(widget)
+
+        return top, slots
+
+
+def plan(elements):
+    '''
+    Return a Plan for realizing the elements.
+    '''
+    ops = []
+    count = [0]
+
+    def visit(parent, element):
+        count[0] += 1
+        slot = count[0]
+
+        if _isLazy(element) or element.tag.lower() == "virtuallist":
+            ops.append(('realize', parent, element))
+            return
+
+        bindings, options, settings, children = _parts(element)
+        ops.append(('create', parent, element.tag, options))
+        for event_specifier, callback in bindings.iteritems():
+            ops.append(('bind', slot, event_specifier, callback))
+        for child in children:
+            visit(slot, child)
+
+        name = element.get('name')
+        if name:
+            ops.append(('name', slot, name))
+        ops.append(('grid', slot, settings))
+
+    for element in elements:
+        visit(0, element)
+    return Plan(ops)
+
+
+class PlanCache:
+    '''
+    Plans for spec sources, made the first time each source is asked for
+    and kept for the next, so a function that makes a window out of a
+    spec string (like text2window() in simpleDemo.py) parses it only
+    once.  At most maxsize plans are kept, the least recently used are
+    dropped first.  hits and misses count the lookups.
+    '''
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+        self.clear()
+
+    def plan(self, source, engine='earley'):
+        '''
+        Return the Plan for the spec in source.
+        '''
+        key = source, engine
+        self._tick += 1
+        entry = self._plans.get(key)
+        if entry is not None:
+            self.hits += 1
+            entry[1] = self._tick
+            return entry[0]
+
+        self.misses += 1
+        if len(self._plans) >= self.maxsize:
+            oldest = min(self._plans, key=lambda key: self._plans[key][1])
+            del self._plans[oldest]
+        result = plan(toXML(source, engine, 'none'))
+        self._plans[key] = [result, self._tick] # plan, last used
+        return result
+
+    def clear(self):
+        '''
+        Forget all the plans.
+        '''
+        self._plans = {}
+        self._tick = 0
+
+
+# A PlanCache for everyone.
+PLANS = PlanCache()
+
+
+#########################################################################
+## Generate Python code that builds the widgets.
+#########################################################################
+
+
+def toPython(source, engine='earley'):
+    '''
+    Return the source of a Python module with a build(master, namespace)
+    function that makes the widgets described by the spec in source,
+    calling the Tkinter constructors, bind() and grid() directly just as
+    realize() would for each top-level element, and returns the list of
+    top-level widgets.  Lazy frames are built eagerly, virtuallists are
+    left to realize().  The first line records the pygoo version, the
+    revision of the generated code and a hash of the spec, see
+    loadBuilder().
+    '''
+    elements = toXML(source, engine, 'none')
+    return _generate(elements, _specKey(source))
+
+
+def loadBuilder(path, engine='earley'):
+    '''
+    Return the build() function for the spec file at path (see toPython()).
+    The generated module is kept next to the spec as path + '.py' (and
+    Python byte-compiles it as usual) and only generated again when the
+    spec or pygoo change.
+    '''
+    f = open(path, 'rb')
+    try:
+        source = f.read()
+    finally:
+        f.close()
+    key = _specKey(source)
+    module_path = path + '.py'
+
+    try:
+        f = open(module_path, 'rb')
+        try:
+            fresh = f.readline() == _generatedHeader(key)
+        finally:
+            f.close()
+    except IOError:
+        fresh = False
+
+    if not fresh:
+        code = _generate(toXML(source, engine, 'none'), key)
+        directory = os.path.dirname(os.path.abspath(module_path))
+        fd, temp = tempfile.mkstemp(dir=directory)
+        f = os.fdopen(fd, 'wb')
+        try:
+            f.write(code)
+        finally:
+            f.close()
+        os.rename(temp, module_path)
+        # A stale .pyc could have the same mtime.
+        for stale in (module_path + 'c', module_path + 'o'):
+            if os.path.exists(stale):
+                os.remove(stale)
+
+    name = '_pygoo_' + key
+    module = sys.modules.get(name)
+    if module is None:
+        module = imp.load_source(name, module_path)
+    return module.build
+
+
+# Bump whenever _generate() changes what it writes, so that loadBuilder()
+# makes the modules it generated before again.
+_GENERATOR_REVISION = 3
+
+
+def _generatedHeader(key):
+    return '# pygoo %s r%d %s\n' % (__version__, _GENERATOR_REVISION, key)
+
+
+def _generate(elements, key):
+    classes = set()
+    body = []
+    line = body.append
+    count = [0, 0] # widget and element variables
+
+    def variable():
+        count[0] += 1
+        return 'w%d' % (count[0] - 1)
+
+    def element_code(e, parent=None):
+        # Make the element again, returning the variable that holds it.
+        count[1] += 1
+        v = 'e%d' % (count[1] - 1)
+        if parent is None:
+            line('    %s = E(%r, %r)' % (v, e.tag, e.attrib))
+        else:
+            line('    %s = S(%s, %r, %r)' % (v, parent, e.tag, e.attrib))
+        if e.text:
+            line('    %s.text = %r' % (v, e.text))
+        for subelement in e:
+            element_code(subelement, v)
+        return v
+
+    # Events as in _walk(), with the widget variable of each element.
+    # Widgets are made and bound at the start events and named and
+    # gridded at the end events.
+    top = []
+    for element in elements:
+        stack = [(element, 'master', None, None)]
+        while stack:
+            e, master, w, settings = stack.pop()
+
+            if w is not None:
+                name = e.get('name')
+                if name:
+                    line('    namespace[%r] = %s' % (name, w))
+                if settings:
+                    line('    %s.grid(%r)' % (w, settings))
+                else:
+                    line('    %s.grid()' % (w,))
+                continue
+
+            w = variable()
+            if master == 'master':
+                top.append(w)
+
+            if e.tag.lower() == 'virtuallist':
+                # Its rows are made as it scrolls, by realize().
+                line('    %s = realize(%s, %s, namespace)'
+                     % (w, master, element_code(e)))
+                continue
+
+            # Generated code isn't lazy.
+            bindings, options, settings, children = _parts(e)
+            stack.append((e, master, w, settings))
+            stack.extend((c, w, None, None) for c in reversed(children))
+            if e.tag.lower() == 'frame':
+                cls = 'Frame'
+            else:
+                cls = e.tag.capitalize()
+
+            classes.add(cls)
+            if options:
+                line('    %s = %s(%s, %r)' % (w, cls, master, options))
+            else:
+                line('    %s = %s(%s)' % (w, cls, master))
+            for event_specifier, callback in bindings.iteritems():
+                line('    if %r in namespace:' % (callback,))
+                line('        %s.bind(%r, namespace[%r])'
+                     % (w, event_specifier, callback))
+
+    head = [
+        _generatedHeader(key).rstrip(),
+        '# Generated from a pygoo spec by pygoo.toPython(), do not edit.',
+        ]
+    if classes:
+        head.append('from Tkinter import %s' % ', '.join(sorted(classes)))
+    if count[1]:
+        head.append('from pygoo import E, S, realize')
+    head.extend([
+        '',
+        '',
+        'def build(master, namespace=None):',
+        '    if namespace is None:',
+        '        namespace = {}',
+        ])
+    return '\n'.join(head + body + ['    return [%s]' % ', '.join(top), ''])
+
+
+#########################################################################
+## Command line tool.
+#########################################################################
+
+
+def compileTree(directory, output=None, jobs=None, pattern='*.goo',
+                engine='earley', report=sys.stdout):
+    '''
+    Compile every spec file under directory whose name matches pattern
+    to an XML file, spread over a pool of jobs worker processes (one per
+    CPU by default.)  Each spec's elements are written by dumpXML(), into
+    the same relative place under the output directory (next to the spec
+    if output is None) with an .xml extension.
+
+    Prints the time taken (or the error) for each file to report, and
+    returns the number of files that failed.
+    '''
+    work = []
+    for path, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        for name in sorted(fnmatch.filter(filenames, pattern)):
+            spec = os.path.join(path, name)
+            target = os.path.splitext(spec)[0] + '.xml'
+            if output is not None:
+                target = os.path.join(
+                    output, os.path.relpath(target, directory))
+            work.append((spec, target, engine))
+
+    pool = multiprocessing.Pool(jobs, _warmUp)
+    failures = 0
+    start = time.time()
+    try:
+        results = pool.imap_unordered(_compileFile, work)
+        for spec, seconds, error in results:
+            if error is None:
+                print >> report, '%8.3fs %s' % (seconds, spec)
+            else:
+                print >> report, '   ERROR %s: %s' % (spec, error)
+                failures += 1
+    finally:
+        pool.close()
+        pool.join()
+
+    print >> report, '%d files, %d failed, %.3fs' % (
+        len(work), failures, time.time() - start)
+    return failures
+
+
+def _warmUp():
+    # Load the grammar state machine once per worker process.
+    Parser()
+
+
+def _compileFile((spec, target, engine)):
+    start = time.time()
+    try:
+        directory = os.path.dirname(target)
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                pass # Another worker made it first.
+        # Write next to target and rename it when done, so a spec that
+        # doesn't parse leaves the last good output alone.
+        fd, temp = tempfile.mkstemp(dir=directory or os.curdir)
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                dumpXML(toXMLFile(spec, engine, 'none'), f)
+            finally:
+                f.close()
+            # mkstemp() makes it private, give it the usual permissions.
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp, 0666 & ~umask)
+            os.rename(temp, target)
+        except:
+            os.remove(temp)
+            raise
+    except Exception, e:
+        return spec, time.time() - start, '%s: %s' % (
+            e.__class__.__name__, e)
+    return spec, time.time() - start, None
+
+
+def main(argv=None):
+    '''
+    python -m pygoo compile [options] DIRECTORY
+    '''
+    parser = optparse.OptionParser(
+        usage='%prog compile [options] DIRECTORY',
+        prog='python -m pygoo',
+        )
+    parser.add_option('-o', '--output', metavar='DIR',
+        help='write the XML files under DIR instead of next to the specs')
+    parser.add_option('-j', '--jobs', type='int', metavar='N',
+        help='number of worker processes (default: one per CPU)')
+    parser.add_option('-p', '--pattern', default='*.goo',
+        help='file name pattern of the specs (default: %default)')
+    engines = sorted(ENGINES) + ['fused']
+    parser.add_option('-e', '--engine', default='earley',
+        choices=engines,
+        help='parser engine, one of %s (default: %%default)' % (
+            ', '.join(engines)))
+    options, args = parser.parse_args(argv)
+
+    if len(args) != 2 or args[0] != 'compile':
+        parser.error('expected: compile DIRECTORY')
+
+    failures = compileTree(
+        args[1],
+        options.output,
+        options.jobs,
+        options.pattern,
+        options.engine,
+        )
+    return failures and 1 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -36,10 +36,18 @@ def _namelist(instance):
 				namedict[name] = 1
 	return namelist
 
+#
+#  Compiled scanner patterns, shared by all instances of a class.
+#
+_patterns = {}
+
 class GenericScanner:
 	def __init__(self, flags=0):
-		pattern = self.reflect()
-		self.re = re.compile(pattern, re.VERBOSE|flags)
+		key = (self.__class__, flags)
+		if not _patterns.has_key(key):
+			pattern = self.reflect()
+			_patterns[key] = re.compile(pattern, re.VERBOSE|flags)
+		self.re = _patterns[key]
 
 		self.index2func = {}
 		for name, number in self.re.groupindex.items():
@@ -180,7 +188,10 @@ class GenericParser:
 
 	def addRule(self, doc, func, _preprocess=1):
 		fn = func
-		rules = string.split(doc)
+		#
+		#  Interned symbols compare (and hash) by identity.
+		#
+		rules = map(intern, string.split(doc))
 
 		index = []
 		for i in range(len(rules)):
@@ -308,9 +319,18 @@ class GenericParser:
 		raise SystemExit
 
 	def parse(self, tokens):
-		sets = [ [(1,0), (2,0)] ]
-		self.links = {}
-		
+		#
+		#  Earley items are coded as ints, see _item(), and each set
+		#  in the chart is a list of items (kept in order, since it
+		#  grows while it is being walked) plus a dict in self.links
+		#  mapping each item in the set to its predecessor links.
+		#  The dict doubles as the set's membership index.
+		#
+		sets = [ [self._item(1, 0), self._item(2, 0)] ]
+		self.links = [ {} ]
+		for item in sets[0]:
+			self.links[0][item] = []
+
 		if self.ruleschanged:
 			self.computeNull()
 			self.newrules = {}
@@ -323,18 +343,23 @@ class GenericParser:
 
 		for i in xrange(len(tokens)):
 			sets.append([])
+			self.links.append({})
 
 			if sets[i] == []:
 				break				
 			self.makeSet(tokens[i], sets, i)
 		else:
 			sets.append([])
+			self.links.append({})
 			self.makeSet(None, sets, len(tokens))
 
 		#_dump(tokens, sets, self.states)
 
-		finalitem = (self.finalState(tokens), 0)
-		if finalitem not in sets[-2]:
+		finalitem = self.finalState(tokens)
+		if finalitem is not None:
+			finalitem = self._item(finalitem, 0)
+		if finalitem is None or \
+		   not self.links[-2].has_key(finalitem):
 			if len(tokens) > 0:
 				self.error(tokens[i-1])
 			else:
@@ -343,6 +368,23 @@ class GenericParser:
 		return self.buildTree(self._START, finalitem,
 				      tokens, len(sets)-2)
 
+	#
+	#  An Earley item (state, parent) is coded as the single int
+	#  parent << _ITEMSHIFT | state; they're smaller than tuples and
+	#  quicker to hash.  Links from an item to its predecessor are
+	#  flat tuples (pitem, pi, citem, ci, rule), the last three being
+	#  None for links made by scanning a token.
+	#
+	_ITEMSHIFT = 24
+	_ITEMMASK = (1 << _ITEMSHIFT) - 1
+	_SCANNED = (None, None, None)
+
+	def _item(self, state, parent):
+		return parent << self._ITEMSHIFT | state
+
+	def _unitem(self, item):
+		return item & self._ITEMMASK, item >> self._ITEMSHIFT
+
 	def isnullable(self, sym):
 		#
 		#  For symbols in G_e only.  If we weren't supporting 1.5,
@@ -380,6 +422,7 @@ class GenericParser:
 		#  \epsilon-nonkernel state together; we'll need it right away.
 		#
 		k = self.cores[tcore] = len(self.states)
+		assert k < self._ITEMMASK, 'too many states to code items'
 		K, NK = _State(k, kitems), _State(k+1, [])
 		self.states[k] = K
 		predicted = {}
@@ -466,19 +509,16 @@ class GenericParser:
 				rv.append(self.goto(state, t))
 		return rv
 
-	def add(self, set, item, i=None, predecessor=None, causal=None):
-		if predecessor is None:
-			if item not in set:
-				set.append(item)
-		else:
-			key = (item, i)
-			if item not in set:
-				self.links[key] = []
-				set.append(item)
-			self.links[key].append((predecessor, causal))
+	def add(self, set, index, item, link=None):
+		if not index.has_key(item):
+			index[item] = []
+			set.append(item)
+		if link is not None:
+			index[item].append(link)
 
 	def makeSet(self, token, sets, i):
 		cur, next = sets[i], sets[i+1]
+		curlinks, nextlinks = self.links[i], self.links[i+1]
 
 		ttype = token is not None and self.typestring(token) or None
 		if ttype is not None:
@@ -487,15 +527,17 @@ class GenericParser:
 			fn, arg = self.gotoST, token
 
 		for item in cur:
-			ptr = (item, i)
-			state, parent = item
+			state, parent = self._unitem(item)
 			add = fn(state, arg)
 			for k in add:
 				if k is not None:
-					self.add(next, (k, parent), i+1, ptr)
+					self.add(next, nextlinks,
+						 self._item(k, parent),
+						 (item, i) + self._SCANNED)
 					nk = self.goto(k, None)
 					if nk is not None:
-						self.add(next, (nk, i+1))
+						self.add(next, nextlinks,
+							 self._item(nk, i+1))
 
 			if parent == i:
 				continue
@@ -503,16 +545,16 @@ class GenericParser:
 			for rule in self.states[state].complete:
 				lhs, rhs = rule
 				for pitem in sets[parent]:
-					pstate, pparent = pitem
+					pstate, pparent = self._unitem(pitem)
 					k = self.goto(pstate, lhs)
 					if k is not None:
-						why = (item, i, rule)
-						pptr = (pitem, parent)
-						self.add(cur, (k, pparent),
-							 i, pptr, why)
+						link = (pitem, parent, item, i, rule)
+						self.add(cur, curlinks,
+							 self._item(k, pparent), link)
 						nk = self.goto(k, None)
 						if nk is not None:
-							self.add(cur, (nk, i))
+							self.add(cur, curlinks,
+								 self._item(nk, i))
 
 	def makeSet_fast(self, token, sets, i):
 		#
@@ -522,90 +564,108 @@ class GenericParser:
 		#  cost of extreme ugliness.
 		#
 		cur, next = sets[i], sets[i+1]
+		curlinks, nextlinks = self.links[i], self.links[i+1]
 		ttype = token is not None and self.typestring(token) or None
+		edges, states = self.edges, self.states
+		shift = self._ITEMSHIFT
+		mask = self._ITEMMASK
+		cleared = ~mask
+		scanned = self._SCANNED
 
 		for item in cur:
-			ptr = (item, i)
-			state, parent = item
+			#state, parent = self._unitem(item)
+			state = item & mask
+			parent = item >> shift
 			if ttype is not None:
-				k = self.edges.get((state, ttype), None)
+				k = edges.get((state, ttype), None)
 				if k is not None:
-					#self.add(next, (k, parent), i+1, ptr)
+					#self.add(next, nextlinks,
+					#	 self._item(k, parent),
+					#	 (item, i) + scanned)
 					#INLINED --v
-					new = (k, parent)
-					key = (new, i+1)
-					if new not in next:
-						self.links[key] = []
+					new = item & cleared | k
+					link = (item, i, None, None, None)
+					if new in nextlinks:
+						nextlinks[new].append(link)
+					else:
+						nextlinks[new] = [link]
 						next.append(new)
-					self.links[key].append((ptr, None))
 					#INLINED --^
 					#nk = self.goto(k, None)
-					nk = self.edges.get((k, None), None)
+					nk = edges.get((k, None), None)
 					if nk is not None:
-						#self.add(next, (nk, i+1))
+						#self.add(next, nextlinks,
+						#	 self._item(nk, i+1))
 						#INLINED --v
-						new = (nk, i+1)
-						if new not in next:
+						new = (i+1) << shift | nk
+						if new not in nextlinks:
+							nextlinks[new] = []
 							next.append(new)
 						#INLINED --^
 			else:
 				add = self.gotoST(state, token)
 				for k in add:
 					if k is not None:
-						self.add(next, (k, parent), i+1, ptr)
+						self.add(next, nextlinks,
+							 self._item(k, parent),
+							 (item, i) + scanned)
 						#nk = self.goto(k, None)
-						nk = self.edges.get((k, None), None)
+						nk = edges.get((k, None), None)
 						if nk is not None:
-							self.add(next, (nk, i+1))
+							self.add(next, nextlinks,
+								 self._item(nk, i+1))
 
 			if parent == i:
 				continue
 
-			for rule in self.states[state].complete:
-				lhs, rhs = rule
+			for rule in states[state].complete:
+				lhs = rule[0]
 				for pitem in sets[parent]:
-					pstate, pparent = pitem
 					#k = self.goto(pstate, lhs)
-					k = self.edges.get((pstate, lhs), None)
+					k = edges.get((pitem & mask, lhs), None)
 					if k is not None:
-						why = (item, i, rule)
-						pptr = (pitem, parent)
-						#self.add(cur, (k, pparent),
-						#	 i, pptr, why)
+						#self.add(cur, curlinks,
+						#	 self._item(k, pparent),
+						#	 (pitem, parent, item, i, rule))
 						#INLINED --v
-						new = (k, pparent)
-						key = (new, i)
-						if new not in cur:
-							self.links[key] = []
+						new = pitem & cleared | k
+						link = (pitem, parent, item, i, rule)
+						if new in curlinks:
+							curlinks[new].append(link)
+						else:
+							curlinks[new] = [link]
 							cur.append(new)
-						self.links[key].append((pptr, why))
 						#INLINED --^
 						#nk = self.goto(k, None)
-						nk = self.edges.get((k, None), None)
+						nk = edges.get((k, None), None)
 						if nk is not None:
-							#self.add(cur, (nk, i))
+							#self.add(cur, curlinks,
+							#	 self._item(nk, i))
 							#INLINED --v
-							new = (nk, i)
-							if new not in cur:
+							new = i << shift | nk
+							if new not in curlinks:
+								curlinks[new] = []
 								cur.append(new)
 							#INLINED --^
 
 	def predecessor(self, key, causal):
-		for p, c in self.links[key]:
-			if c == causal:
-				return p
+		item, k = key
+		for link in self.links[k][item]:
+			if link[2:] == causal:
+				return link[:2]
 		assert 0
 
 	def causal(self, key):
-		links = self.links[key]
+		item, k = key
+		links = self.links[k][item]
 		if len(links) == 1:
-			return links[0][1]
+			return links[0][2:]
 		choices = []
 		rule2cause = {}
-		for p, c in links:
-			rule = c[2]
+		for link in links:
+			rule = link[4]
 			choices.append(rule)
-			rule2cause[rule] = c
+			rule2cause[rule] = link[2:]
 		return rule2cause[self.ambiguity(choices)]
 
 	def deriveEpsilon(self, nt):
@@ -623,7 +683,7 @@ class GenericParser:
 		return self.rule2func[self.new2old[rule]](attr)
 
 	def buildTree(self, nt, item, tokens, k):
-		state, parent = item
+		state, parent = self._unitem(item)
 
 		choices = []
 		for rule in self.states[state].complete:
@@ -643,7 +703,8 @@ class GenericParser:
 				if sym != self._BOF:
 					attr[i] = tokens[k-1]
 					key = (item, k)
-					item, k = self.predecessor(key, None)
+					item, k = self.predecessor(key,
+								   self._SCANNED)
 			#elif self.isnullable(sym):
 			elif self._NULLABLE == sym[0:len(self._NULLABLE)]:
 				attr[i] = self.deriveEpsilon(sym)
@@ -836,8 +897,10 @@ def _dump(tokens, sets, states):
 	for i in range(len(sets)):
 		print 'set', i
 		for item in sets[i]:
-			print '\t', item
-			for (lhs, rhs), pos in states[item[0]].items:
+			state = item & GenericParser._ITEMMASK
+			parent = item >> GenericParser._ITEMSHIFT
+			print '\t', (state, parent)
+			for (lhs, rhs), pos in states[state].items:
 				print '\t\t', lhs, '::=',
 				print string.join(rhs[:pos]),
 				print '.',